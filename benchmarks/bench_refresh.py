@@ -0,0 +1,84 @@
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fakeproc import FakeProc
+from linux_procexp.procutil import Process, ProcUtil
+
+# usage: python benchmarks/bench_refresh.py [--sizes 1000,10000,50000]
+# builds a synthetic proc tree per size and times the expensive paths of
+# the explorer against it. the results are printed as one line per
+# benchmark so they can be compared between versions
+
+def bench(name, size, func, repeat, setup=None):
+    # setup, if given, runs untimed before every run
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    print('{:<24} {:>8} {:>10.1f} ms (best of {})'.format(name, size, min(times) * 1000, repeat))
+
+
+def run(size, args):
+    root = tempfile.mkdtemp(prefix='fakeproc-')
+    try:
+        fake = FakeProc(root)
+        start = time.perf_counter()
+        fake.build(size, threads=args.threads, fds=args.fds, maps=args.maps)
+        print('{:<24} {:>8} {:>10.1f} ms'.format('build fixture', size,
+                                                 (time.perf_counter() - start) * 1000))
+        ProcUtil.set_proc_path(root)
+
+        # the model needs PyQt4 but not a display
+        from PyQt4.QtCore import Qt
+        from linux_procexp.proctablemodel import ProcTableModel, ProcTableModelRefresher
+
+        models = []
+        bench('setProcHierarchy', size, lambda: models.append(ProcTableModel()), 1)
+        model = models[-1]
+
+        # going back from a sorted table to the process tree
+        bench('removeSort', size, model.removeSort, args.repeat,
+              setup=lambda: model.sort(1, Qt.DescendingOrder))
+
+        refresher = ProcTableModelRefresher(model, workers=args.workers)
+        refresher.modelRefresh.connect(model.update)
+
+        fake.tick()
+        bench('refresh', size, refresher.refresh, args.repeat)
+
+        bench('findHandlesBySubstr', size, lambda: model.findHandlesBySubstr('libssl'),
+              args.repeat)
+
+        processes = [Process(pid) for pid in ProcUtil.pids()]
+        bench('memory_maps', size,
+              lambda: [proc.memory_maps() for proc in processes], args.repeat)
+    finally:
+        ProcUtil.set_proc_path('/proc')
+        shutil.rmtree(root)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='refresh cost benchmarks on a synthetic /proc')
+    parser.add_argument('--sizes', default='1000,10000,50000',
+                        help='comma separated process counts (default: 1000,10000,50000)')
+    parser.add_argument('--threads', type=int, default=2, help='threads per process')
+    parser.add_argument('--fds', type=int, default=8, help='open fds per process')
+    parser.add_argument('--maps', type=int, default=32, help='memory maps per process')
+    parser.add_argument('--workers', type=int, default=1, help='collector threads')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per benchmark')
+    args = parser.parse_args()
+    for size in (int(size) for size in args.sizes.split(',')):
+        run(size, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+import os
+import random
+
+# builds a synthetic proc tree that linux_procexp can read once it is
+# pointed at it with ProcUtil.set_proc_path(). only the files the explorer
+# reads are generated and their layout follows proc(5)
+
+STAT_FORMAT = ('{pid} ({comm}) {state} {ppid} {pid} {pid} 0 -1 4194304 100 0 0 0 '
+               '{utime} {stime} 0 0 {priority} {nice} {threads} 0 {starttime} '
+               '{vsize} {rss_pages} 18446744073709551615 0 0 0 0 0 0 0 0 0 0 0 0 17 0 0 0 0 0 0')
+
+STATUS_FORMAT = ('Name:\t{comm}\nUmask:\t0022\nState:\t{state} (sleeping)\nTgid:\t{pid}\n'
+                 'Ngid:\t0\nPid:\t{pid}\nPPid:\t{ppid}\nTracerPid:\t0\n'
+                 'Uid:\t{uid}\t{uid}\t{uid}\t{uid}\nGid:\t{uid}\t{uid}\t{uid}\t{uid}\n'
+                 'FDSize:\t64\nVmPeak:\t{vsize_kb} kB\nVmSize:\t{vsize_kb} kB\n'
+                 'VmHWM:\t{rss_kb} kB\nVmRSS:\t{rss_kb} kB\nThreads:\t{threads}\n')
+
+LIBRARIES = ['/usr/lib/x86_64-linux-gnu/lib{}.so.{}'.format(name, version)
+             for name in ('c', 'm', 'pthread', 'dl', 'ssl', 'crypto', 'z', 'stdc++',
+                          'gcc_s', 'ffi', 'glib-2.0', 'dbus-1', 'systemd', 'uuid')
+             for version in (1, 6)]
+
+
+class FakeProc(object):
+    def __init__(self, root, seed=0):
+        self.root = root
+        self.random = random.Random(seed)
+        self.total_work = 0
+        self.cpus = 4
+        self.mem_total_kb = 16 * 1024 * 1024
+
+    def build(self, processes, threads=1, fds=4, maps=16, cpus=4,
+              mem_total_kb=16 * 1024 * 1024):
+        os.makedirs(self.root, exist_ok=True)
+        self.cpus = cpus
+        self.mem_total_kb = mem_total_kb
+        self.write_system()
+        for pid in range(1, processes + 1):
+            # pid 1 is init, every other process hangs off a random
+            # earlier one so the hierarchy has some depth to it
+            ppid = 0 if pid == 1 else self.random.randint(1, pid - 1)
+            self.write_process(pid, ppid, threads, fds, maps)
+        return self.root
+
+    def write_system(self):
+        cpus = self.cpus
+        mem_total_kb = self.mem_total_kb
+        self.total_work += 100000
+        cpu_line = 'cpu  {} 0 {} {} 0 0 0 0 0 0\n'
+        lines = [cpu_line.format(self.total_work // 4, self.total_work // 4, self.total_work // 2)]
+        lines += ['cpu{} '.format(i) + cpu_line[5:].format(1, 1, 1) for i in range(cpus)]
+        lines.append('intr 0\nctxt 0\n')
+        self._write('stat', ''.join(lines))
+
+        meminfo = ['MemTotal', 'MemFree', 'MemAvailable', 'Buffers', 'Cached',
+                   'SwapCached', 'Active', 'Inactive']
+        self._write('meminfo', ''.join('{}: {:>12} kB\n'.format(key, mem_total_kb // (i + 1))
+                                       for i, key in enumerate(meminfo)))
+        self._write('partitions', 'major minor  #blocks  name\n\n'
+                                  '   8        0  488386584 sda\n'
+                                  '   8        1     524288 sda1\n')
+
+    def write_process(self, pid, ppid, threads, fds, maps):
+        pid_dir = os.path.join(self.root, str(pid))
+        comm = 'proc{}'.format(pid)
+        self._write_task(pid_dir, pid, ppid, comm, threads)
+        with open(os.path.join(pid_dir, 'cmdline'), 'w') as f:
+            f.write('/usr/bin/{}\0--flag\0'.format(comm))
+        os.symlink('/usr/bin/{}'.format(comm), os.path.join(pid_dir, 'exe'))
+        os.symlink('/', os.path.join(pid_dir, 'cwd'))
+
+        fd_dir = os.path.join(pid_dir, 'fd')
+        os.mkdir(fd_dir)
+        for fd in range(fds):
+            target = '/var/log/{}/file{}.log'.format(comm, fd) if fd % 2 else \
+                     'socket:[{}]'.format(pid * 1000 + fd)
+            os.symlink(target, os.path.join(fd_dir, str(fd)))
+
+        lines = []
+        address = 0x400000
+        for i in range(maps):
+            name = self.random.choice(LIBRARIES) if i % 4 else ''
+            lines.append('{:x}-{:x} r-xp 00000000 08:01 {} {}\n'.format(
+                address, address + 0x1000, 1000 + i, name))
+            address += 0x2000
+        with open(os.path.join(pid_dir, 'maps'), 'w') as f:
+            f.writelines(lines)
+
+        task_dir = os.path.join(pid_dir, 'task')
+        os.mkdir(task_dir)
+        for tid in [pid] + [pid * 100000 + i for i in range(1, threads)]:
+            self._write_task(os.path.join(task_dir, str(tid)), tid, ppid, comm, 1)
+
+    def _write_task(self, task_dir, pid, ppid, comm, threads):
+        os.mkdir(task_dir)
+        rss_kb = self.random.randint(1, 512) * 1024
+        vsize_kb = rss_kb * 4
+        values = dict(pid=pid, ppid=ppid, comm=comm, state='S', threads=threads,
+                      utime=self.random.randint(0, 10000), stime=self.random.randint(0, 1000),
+                      priority=20, nice=0, starttime=pid, uid=0,
+                      vsize=vsize_kb * 1024, vsize_kb=vsize_kb,
+                      rss_pages=rss_kb // 4, rss_kb=rss_kb)
+        with open(os.path.join(task_dir, 'stat'), 'w') as f:
+            f.write(STAT_FORMAT.format(**values) + '\n')
+        with open(os.path.join(task_dir, 'status'), 'w') as f:
+            f.write(STATUS_FORMAT.format(**values))
+
+    def tick(self, pids=None):
+        # advances the cpu counters of pids (all processes by default)
+        # so a refresh has some work to show
+        self.write_system()
+        for entry in pids or os.listdir(self.root):
+            stat_path = os.path.join(self.root, str(entry), 'stat')
+            if not os.path.exists(stat_path):
+                continue
+            with open(stat_path) as f:
+                head, _, tail = f.read().rpartition(')')
+            fields = tail.split()
+            # utime is the 14th field, the 12th after the name
+            fields[11] = str(int(fields[11]) + self.random.randint(0, 100))
+            with open(stat_path, 'w') as f:
+                f.write(head + ') ' + ' '.join(fields) + '\n')
+
+    def _write(self, name, content):
+        with open(os.path.join(self.root, name), 'w') as f:
+            f.write(content)
@@ -0,0 +1,60 @@
+import argparse
+from . import headless, agent
+from .procutil import ProcUtil
+from .proccolumns import ProcColumns
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m linux_procexp')
+    parser.add_argument('--stats', action='store_true',
+                        help='print call counts and timings on exit')
+    parser.add_argument('--proc-root', default='/proc',
+                        help='read processes from this directory instead of /proc')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    collectParser = commands.add_parser(
+        'collect', help='stream process snapshots as JSON Lines without the GUI')
+    collectParser.add_argument('-i', '--interval', type=float, default=2.0,
+                               help='seconds between samples (default: 2)')
+    collectParser.add_argument('-n', '--count', type=int, default=0,
+                               help='number of samples to take (default: until interrupted)')
+    collectParser.add_argument('-o', '--output', help='file to append to instead of stdout')
+    collectParser.add_argument('-f', '--fields',
+                               help='comma separated fields to include, from: {}'.format(
+                                   ','.join(headless.SnapshotStreamer.FIELDS)))
+    collectParser.add_argument('--changed-only', action='store_true',
+                               help='only write processes whose fields changed and exits')
+    collectParser.add_argument('--workers', type=int, default=1,
+                               help='threads reading /proc on every sample')
+    collectParser.add_argument('--top', type=int, default=0,
+                               help='only write this many processes per sample, the top ones '
+                                    'by --top-by')
+    collectParser.add_argument('--top-by', default='cpu', choices=sorted(ProcColumns.COLUMNS),
+                               help='column --top ranks processes by (default: cpu)')
+    collectParser.set_defaults(func=headless.collect)
+
+    agentParser = commands.add_parser(
+        'agent', help='serve process snapshots to viewers started with --connect')
+    agentParser.add_argument('-l', '--listen', required=True,
+                             help='socket path, or host:port (:port for localhost only, '
+                                  '0.0.0.0:port for all interfaces, unauthenticated)')
+    agentParser.add_argument('-i', '--interval', type=float, default=2.0,
+                             help='seconds between samples (default: 2)')
+    agentParser.add_argument('-n', '--count', type=int, default=0,
+                             help='number of samples to take (default: until interrupted)')
+    agentParser.add_argument('--workers', type=int, default=1,
+                             help='threads reading /proc on every sample')
+    agentParser.add_argument('--no-pid-events', dest='pid_events', action='store_false',
+                             help='list /proc every sample instead of following fork/exit events')
+    agentParser.set_defaults(func=agent.serve)
+
+    args = parser.parse_args()
+    ProcUtil.set_proc_path(args.proc_root)
+    if args.command == 'collect' and args.fields:
+        unknown = set(args.fields.split(',')) - set(headless.SnapshotStreamer.FIELDS)
+        if unknown:
+            parser.error('unknown fields: {}'.format(', '.join(sorted(unknown))))
+    args.func(args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,552 @@
+import errno
+import os
+import select
+import selectors
+import signal
+import socket
+import stat
+import struct
+import time
+import zlib
+from array import array
+from .collector import ProcCollector
+from .instrumentation import timed
+from .proccolumns import ProcColumns
+from .procevents import open_pid_source
+from .procutil import Process, ProcUtil
+from .recording import Row
+
+# an agent collects the process table of the machine it runs on and
+# serves it over a Unix or TCP socket, so a viewer elsewhere only applies
+# what changed. every message in either direction is a frame: a _FRAME
+# header (kind, length) followed by its payload.
+#
+#   HELLO      agent -> client once on connect: protocol version, tick
+#              interval and host name
+#   SUBSCRIBE  client -> agent: the fields and pids the client shows. the
+#              other pids only get their structure fields (see below) on
+#              every tick and their values once every BACKGROUND_TICKS
+#   TICK       agent -> client after every tick it collected: zlib
+#              compressed, the pids that exited and one entry per process
+#              the client has to hear about, carrying the fields in its mask
+#
+# a process entry with the starttime bit set is a new process, the client
+# starts it over from DEFAULT_ROW. a recycled pid is sent as removed and
+# added again in the same tick
+PROTOCOL_VERSION = 1
+HELLO = 1
+SUBSCRIBE = 2
+TICK = 3
+
+_FRAME = struct.Struct('<BI')
+_HELLO = struct.Struct('<Hd')
+# fields mask, flags, pid count (ALL_PIDS for every pid) then the pids
+_SUBSCRIBE = struct.Struct('<HBI')
+_TICK = struct.Struct('<dII')
+_ENTRY = struct.Struct('<iH')
+_STRING = struct.Struct('<H')
+ALL_PIDS = 0xffffffff
+
+# set in SUBSCRIBE to have every value that changed sent on the next tick,
+# whether subscribed or not, e.g. so the client can sort on them
+SEND_ALL_ONCE = 1
+
+# the fields of a recording.Row in the order of their mask bits. cpu and
+# mem go over the wire in hundredths of a percent
+FIELDS = [('starttime', 'Q'), ('ppid', 'i'), ('name', 's'), ('owner', 's'), ('cpu', 'i'),
+          ('mem', 'i'), ('rss', 'q'), ('vsize', 'q'), ('nice', 'i'), ('priority', 'i')]
+_FIELD_STRUCTS = {code: struct.Struct('<' + code) for code in 'iqQ'}
+_PERCENT_FIELDS = (Row._fields.index('cpu'), Row._fields.index('mem'))
+_STARTTIME_BIT = 1
+ALL_FIELDS = (1 << len(FIELDS)) - 1
+# what every client gets for every process so it can place it in the tree
+STRUCTURE_FIELDS = 0b111
+
+DEFAULT_ROW = Row(0, 0, '', '', 0.0, 0.0, 0, 0, 0, 0)
+
+
+def field_mask(names):
+    bits = {name: 1 << bit for bit, (name, _) in enumerate(FIELDS)}
+    unknown = set(names) - bits.keys()
+    if unknown:
+        raise ValueError('unknown fields: {}'.format(', '.join(sorted(unknown))))
+    return sum(bits[name] for name in set(names))
+
+
+def parse_address(address):
+    # anything with a / in it is a Unix socket path, 'unix:' can force one.
+    # otherwise it is host:port, or :port for the loopback interface. there
+    # is no authentication, only 0.0.0.0:port listens on every interface
+    if address.startswith('unix:'):
+        return socket.AF_UNIX, address[len('unix:'):]
+    if '/' in address:
+        return socket.AF_UNIX, address
+    host, colon, port = address.rpartition(':')
+    if not colon or not port.isdigit():
+        raise ValueError('not a socket path or host:port: {}'.format(address))
+    return socket.AF_INET, (host.strip('[]') or '127.0.0.1', int(port))
+
+
+def _frame(kind, payload):
+    return _FRAME.pack(kind, len(payload)) + payload
+
+
+def _pack_string(value):
+    data = value.encode()[:0xffff]
+    return _STRING.pack(len(data)) + data
+
+
+def _unpack_string(payload, offset):
+    length, = _STRING.unpack_from(payload, offset)
+    offset += _STRING.size
+    return payload[offset:offset + length].decode(errors='replace'), offset + length
+
+
+def _wire(field, value):
+    return int(round(value * 100)) if field in _PERCENT_FIELDS else value
+
+
+def _pack_entry(pid, mask, row):
+    parts = [_ENTRY.pack(pid, mask)]
+    for field, (_, code) in enumerate(FIELDS):
+        if mask & (1 << field):
+            if code == 's':
+                parts.append(_pack_string(row[field]))
+            else:
+                parts.append(_FIELD_STRUCTS[code].pack(_wire(field, row[field])))
+    return b''.join(parts)
+
+
+def _changed_fields(old, new, mask):
+    # the bits of mask whose field differs, in the precision it is sent in
+    changed = 0
+    for field in range(len(FIELDS)):
+        bit = 1 << field
+        if mask & bit and old[field] != new[field] and \
+                _wire(field, old[field]) != _wire(field, new[field]):
+            changed |= bit
+    return changed
+
+
+def _take_frame(inbox):
+    # removes and returns the complete frame at the start of inbox, or None
+    # if it has not all arrived yet
+    if len(inbox) < _FRAME.size:
+        return None
+    kind, length = _FRAME.unpack_from(inbox, 0)
+    end = _FRAME.size + length
+    if end > len(inbox):
+        return None
+    payload = bytes(inbox[_FRAME.size:end])
+    del inbox[:end]
+    return kind, payload
+
+
+def _take_frames(inbox):
+    # removes and yields the complete frames at the start of inbox
+    offset = 0
+    while len(inbox) - offset >= _FRAME.size:
+        kind, length = _FRAME.unpack_from(inbox, offset)
+        end = offset + _FRAME.size + length
+        if end > len(inbox):
+            break
+        yield kind, bytes(inbox[offset + _FRAME.size:end])
+        offset = end
+    del inbox[:offset]
+
+
+class _Session(object):
+    # the agent's side of one client connection
+    def __init__(self, sock):
+        self.sock = sock
+        self.inbox = bytearray()
+        self.outbox = bytearray()
+
+        # everything is sent until the client subscribes
+        self.fields = ALL_FIELDS
+        self.pids = None
+        self.send_all_once = False
+
+        # pid -> Row of what the client has been told, the fields it was
+        # not sent are left at their DEFAULT_ROW values
+        self.sent = {}
+        # pids with values the client was not sent as it did not want them
+        self.stale = set()
+
+    def subscribe(self, payload):
+        fields, flags, count = _SUBSCRIBE.unpack_from(payload, 0)
+        pids = None
+        if count != ALL_PIDS:
+            pids = array('i')
+            pids.frombytes(payload[_SUBSCRIBE.size:_SUBSCRIBE.size + count * pids.itemsize])
+            pids = frozenset(pids)
+        # no process was sent the fields that are new to the subscription
+        fields |= STRUCTURE_FIELDS
+        if fields & ~self.fields:
+            self.stale.update(self.sent)
+        self.fields = fields
+        self.pids = pids
+        self.send_all_once |= bool(flags & SEND_ALL_ONCE)
+
+    def wants(self, pid):
+        return self.pids is None or pid in self.pids
+
+    def tick(self, timestamp, rows, removed, changed, due):
+        # returns the TICK frame telling the client about the tick
+        sent = self.sent
+        gone = array('i', (pid for pid in removed if sent.pop(pid, None) is not None))
+        self.stale.difference_update(gone)
+
+        everything = self.send_all_once
+        self.send_all_once = False
+        if everything or not sent:
+            candidates = rows.keys()
+        else:
+            # the pids that became wanted get what they missed
+            candidates = changed | {pid for pid in self.stale if self.wants(pid) or due(pid)}
+        entries = []
+        for pid in candidates:
+            row = rows.get(pid)
+            if row is None:
+                continue
+            wanted = everything or self.wants(pid) or due(pid)
+            fields = self.fields if wanted else STRUCTURE_FIELDS
+            old = sent.get(pid)
+            if old is None:
+                mask = fields
+                old = DEFAULT_ROW
+            else:
+                mask = _changed_fields(old, row, fields)
+            if wanted:
+                self.stale.discard(pid)
+            elif _changed_fields(old, row, self.fields & ~STRUCTURE_FIELDS):
+                self.stale.add(pid)
+            if not mask:
+                continue
+            entries.append(_pack_entry(pid, mask, row))
+            sent[pid] = row if mask == ALL_FIELDS else \
+                Row._make(row[field] if mask & (1 << field) else old[field]
+                          for field in range(len(FIELDS)))
+
+        body = _TICK.pack(timestamp, len(gone), len(entries)) + gone.tobytes() + b''.join(entries)
+        return _frame(TICK, zlib.compress(body, 1))
+
+
+class SnapshotAgent(object):
+    # collects every interval seconds and serves the result to the
+    # clients connected to listener, a bound and listening socket. the
+    # processes some client shows are read on every tick, the rest once
+    # every BACKGROUND_TICKS ticks as ProcTableModelRefresher does
+    BACKGROUND_TICKS = 15
+
+    # a client this far behind on reading its ticks is dropped
+    MAX_BACKLOG = 32 * 1024 * 1024
+
+    def __init__(self, listener, interval=2.0, workers=1, pid_events=True):
+        self.listener = listener
+        self.listener.setblocking(False)
+        self.interval = interval
+        self.hostname = socket.gethostname()
+        self.collector = ProcCollector(workers)
+        self.pid_source = open_pid_source(pid_events)
+        self.columns = ProcColumns()
+        self.ticks = 0
+
+        # pid -> Process and pid -> Row of the last tick
+        self.processes = {}
+        self.rows = {}
+
+        self.sessions = {}
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.listener, selectors.EVENT_READ)
+
+    def due(self, pid):
+        return pid % self.BACKGROUND_TICKS == self.ticks % self.BACKGROUND_TICKS
+
+    def wanted_pids(self):
+        # the pids read every tick, None for all of them
+        wanted = set()
+        for session in self.sessions.values():
+            if session.pids is None or session.send_all_once:
+                return None
+            wanted |= session.pids
+        return wanted
+
+    @timed('agent.tick')
+    def tick(self):
+        sample = ProcUtil.system_sample()
+        self.ticks += 1
+
+        listed = self.pid_source.update()
+        for pid in self.pid_source.execed:
+            process = self.processes.get(pid)
+            if process is not None:
+                process.forget_static()
+        new = []
+        for pid in listed:
+            if pid not in self.processes:
+                try:
+                    new.append(Process(pid))
+                except ValueError:
+                    continue
+
+        wanted = self.wanted_pids()
+        read = [process for pid, process in self.processes.items() if pid in listed and
+                (wanted is None or pid in wanted or self.due(pid))]
+        snapshots, gone = self.collector.collect(read + new, sample)
+        gone |= self.processes.keys() - listed
+
+        # a recycled pid is removed and comes back as a new process
+        removed = set(gone)
+        for process in read:
+            pid = process.pid()
+            snap = snapshots.get(pid)
+            row = self.rows.get(pid)
+            if snap is not None and row is not None and snap.starttime != row.starttime:
+                removed.add(pid)
+        for pid in removed:
+            self.processes.pop(pid, None)
+            self.rows.pop(pid, None)
+            self.columns.release(pid)
+        for process in read + new:
+            if process.pid() in snapshots:
+                self.processes[process.pid()] = process
+
+        for pid, snap in snapshots.items():
+            self.columns.store(pid, snap)
+        self.columns.compute(sample)
+
+        pending = self.columns.pending
+        changed = set()
+        for pid, snap in snapshots.items():
+            if pid in gone:
+                continue
+            slot = self.columns.slots[pid]
+            row = Row(snap.starttime, snap.ppid, snap.name, snap.owner, pending['cpu'][slot],
+                      pending['mem'][slot], snap.rss, snap.vsize, snap.nice, snap.priority)
+            if self.rows.get(pid) != row:
+                self.rows[pid] = row
+                changed.add(pid)
+
+        timestamp = time.time()
+        for session in list(self.sessions.values()):
+            self.send(session, session.tick(timestamp, self.rows, removed, changed, self.due))
+
+    def accept(self):
+        try:
+            sock, _ = self.listener.accept()
+        except BlockingIOError:
+            return
+        sock.setblocking(False)
+        session = _Session(sock)
+        self.sessions[sock] = session
+        self.selector.register(sock, selectors.EVENT_READ)
+        self.send(session, _frame(HELLO, _HELLO.pack(PROTOCOL_VERSION, self.interval) +
+                                  _pack_string(self.hostname)))
+
+    def drop(self, session):
+        self.selector.unregister(session.sock)
+        del self.sessions[session.sock]
+        session.sock.close()
+
+    def send(self, session, frame):
+        session.outbox += frame
+        if len(session.outbox) > self.MAX_BACKLOG:
+            self.drop(session)
+            return
+        self.flush(session)
+
+    def flush(self, session):
+        try:
+            sent = session.sock.send(session.outbox)
+        except BlockingIOError:
+            sent = 0
+        except OSError:
+            self.drop(session)
+            return
+        del session.outbox[:sent]
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if session.outbox else 0)
+        self.selector.modify(session.sock, events)
+
+    def receive(self, session):
+        try:
+            data = session.sock.recv(65536)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self.drop(session)
+            return
+        session.inbox += data
+        try:
+            for kind, payload in _take_frames(session.inbox):
+                if kind == SUBSCRIBE:
+                    session.subscribe(payload)
+        except struct.error:
+            self.drop(session)
+
+    def run(self, count=0):
+        next_tick = time.monotonic()
+        try:
+            while not count or self.ticks < count:
+                timeout = max(0, next_tick - time.monotonic())
+                for key, events in self.selector.select(timeout):
+                    if key.fileobj is self.listener:
+                        self.accept()
+                        continue
+                    session = self.sessions.get(key.fileobj)
+                    if session is not None and events & selectors.EVENT_READ:
+                        self.receive(session)
+                    session = self.sessions.get(key.fileobj)
+                    if session is not None and events & selectors.EVENT_WRITE:
+                        self.flush(session)
+                if time.monotonic() >= next_tick:
+                    self.tick()
+                    # a tick that overran is not made up for
+                    next_tick = max(next_tick + self.interval, time.monotonic())
+        finally:
+            self.close()
+
+    def close(self):
+        for session in list(self.sessions.values()):
+            self.drop(session)
+        self.selector.close()
+        path = self.listener.getsockname() if self.listener.family == socket.AF_UNIX else None
+        self.listener.close()
+        if path:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+        self.pid_source.close()
+        self.collector.shutdown()
+
+
+def listen(address):
+    family, addr = parse_address(address)
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    if family == socket.AF_UNIX:
+        # a socket file left behind by an agent that did not exit cleanly
+        # is replaced, anything else at the path is left alone
+        try:
+            mode = os.stat(addr).st_mode
+        except FileNotFoundError:
+            pass
+        else:
+            if not stat.S_ISSOCK(mode):
+                sock.close()
+                raise FileExistsError(errno.EEXIST, 'not a socket', addr)
+            os.unlink(addr)
+    else:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(addr)
+    sock.listen(16)
+    return sock
+
+
+class AgentConnection(object):
+    # a client's connection to a SnapshotAgent. receive() applies the
+    # ticks that arrived so far to state, pid -> recording.Row
+    def __init__(self, address, timeout=5.0):
+        self.address = address
+        family, addr = parse_address(address)
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        try:
+            self.sock.connect(addr)
+            self.inbox = bytearray()
+            kind, payload = self._read_frame()
+        except (OSError, struct.error):
+            self.sock.close()
+            raise
+        if kind != HELLO:
+            self.sock.close()
+            raise ConnectionError('{} is not a process agent'.format(address))
+        version, self.interval = _HELLO.unpack_from(payload, 0)
+        if version != PROTOCOL_VERSION:
+            self.sock.close()
+            raise ConnectionError('{} speaks protocol version {}'.format(address, version))
+        self.hostname, _ = _unpack_string(payload, _HELLO.size)
+        self.sock.settimeout(None)
+        self.state = {}
+
+    def _read_frame(self):
+        while True:
+            frame = _take_frame(self.inbox)
+            if frame is not None:
+                return frame
+            data = self.sock.recv(65536)
+            if not data:
+                raise ConnectionError('{} closed the connection'.format(self.address))
+            self.inbox += data
+
+    def subscribe(self, fields=ALL_FIELDS, pids=None, send_all_once=False):
+        # pids None subscribes to every process
+        flags = SEND_ALL_ONCE if send_all_once else 0
+        if pids is None:
+            payload = _SUBSCRIBE.pack(fields, flags, ALL_PIDS)
+        else:
+            pids = array('i', sorted(pids))
+            payload = _SUBSCRIBE.pack(fields, flags, len(pids)) + pids.tobytes()
+        self.sock.sendall(_frame(SUBSCRIBE, payload))
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def receive(self):
+        # reads what arrived without blocking and returns the set of pids
+        # that were added, changed or removed
+        while select.select([self.sock], [], [], 0)[0]:
+            data = self.sock.recv(1 << 20)
+            if not data:
+                raise ConnectionError('{} closed the connection'.format(self.address))
+            self.inbox += data
+
+        touched = set()
+        for kind, payload in _take_frames(self.inbox):
+            if kind == TICK:
+                touched |= self._apply(zlib.decompress(payload))
+        return touched
+
+    def _apply(self, payload):
+        state = self.state
+        _, removed, entries = _TICK.unpack_from(payload, 0)
+        offset = _TICK.size
+        pids = array('i')
+        pids.frombytes(payload[offset:offset + removed * pids.itemsize])
+        offset += removed * pids.itemsize
+        for pid in pids:
+            state.pop(pid, None)
+        touched = set(pids)
+
+        for _ in range(entries):
+            pid, mask = _ENTRY.unpack_from(payload, offset)
+            offset += _ENTRY.size
+            values = list(DEFAULT_ROW if mask & _STARTTIME_BIT else state[pid])
+            for field, (_, code) in enumerate(FIELDS):
+                if mask & (1 << field):
+                    if code == 's':
+                        values[field], offset = _unpack_string(payload, offset)
+                    else:
+                        values[field], = _FIELD_STRUCTS[code].unpack_from(payload, offset)
+                        offset += _FIELD_STRUCTS[code].size
+                        if field in _PERCENT_FIELDS:
+                            values[field] /= 100
+            state[pid] = Row._make(values)
+            touched.add(pid)
+        return touched
+
+    def close(self):
+        self.sock.close()
+
+
+def serve(args):
+    agent = SnapshotAgent(listen(args.listen), args.interval, args.workers, args.pid_events)
+    # a service manager stops the agent with SIGTERM, which then leaves
+    # through the same cleanup as ^C and removes its socket file
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        agent.run(args.count)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,122 @@
+import multiprocessing
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from .procutil import ProcUtil
+from .instrumentation import record
+
+
+def _parse_shard(raw_shard):
+    # runs in a parser process so it has to be a module level function. the
+    # cpu time the parsing took is handed back with the parsed shard
+    start = time.process_time()
+    parsed = [(ProcUtil.parse_stat(stat), ProcUtil.parse_status(status))
+              for stat, status in raw_shard]
+    return time.process_time() - start, parsed
+
+
+class ProcCollector(object):
+    # the errors reading a process' files raise once the process is gone
+    PROCESS_GONE_ERRORS = (FileNotFoundError, ProcessLookupError)
+
+    def __init__(self, workers=1, parse_processes=0):
+        # reading /proc blocks in syscalls that release the GIL, so a pool of
+        # threads can read several processes at a time. parsing is pure python
+        # and can optionally be handed to a pool of processes instead
+        self.workers = max(1, workers)
+        self.parse_processes = max(0, parse_processes)
+        self._threads = ThreadPoolExecutor(self.workers) if self.workers > 1 else None
+        # forkserver rather than fork so the parsers do not inherit the
+        # threads (Qt's included) of the process creating them
+        self._parsers = ProcessPoolExecutor(
+            self.parse_processes, mp_context=multiprocessing.get_context('forkserver')) \
+            if self.parse_processes else None
+
+        # wall time in seconds of the last collect() call
+        self.last_tick_time = 0
+
+        # cpu seconds the parser processes spent so far. they are children
+        # of the forkserver so they do not show up in this process' times
+        self.parser_cpu_time = 0
+
+    def _map(self, func, shards):
+        if self._threads:
+            return list(self._threads.map(func, shards))
+        return [func(shard) for shard in shards]
+
+    def _shard(self, processes, count):
+        return [processes[i::count] for i in range(count) if processes[i::count]]
+
+    def _snapshot_shard(self, shard, sample):
+        snapshots = []
+        for proc in shard:
+            try:
+                snapshots.append(proc.snapshot(sample))
+            except self.PROCESS_GONE_ERRORS:
+                snapshots.append(None)
+        return shard, snapshots
+
+    def _read_shard(self, shard):
+        read = []
+        raws = []
+        for proc in shard:
+            try:
+                raws.append(proc.read_raw())
+            except self.PROCESS_GONE_ERRORS:
+                continue
+            read.append(proc)
+        return read, raws
+
+    def collect(self, processes, sample):
+        # returns a dict of pid -> Process.Snapshot for the processes that
+        # could be read and a set of the pids of the processes that are gone
+        start = time.perf_counter()
+        snapshots = {}
+        if self._parsers:
+            results = self._map(self._read_shard, self._shard(
+                processes, max(self.workers, self.parse_processes)))
+            readProcs = [read for read, raws in results]
+            parsed = self._parsers.map(_parse_shard, [raws for read, raws in results])
+            for shard, (cpuTime, parsedShard) in zip(readProcs, parsed):
+                self.parser_cpu_time += cpuTime
+                for proc, (stat, status) in zip(shard, parsedShard):
+                    try:
+                        snapshots[proc.pid()] = proc.snapshot(sample, stat, status)
+                    except self.PROCESS_GONE_ERRORS:
+                        # name() may still need to read the process' files
+                        pass
+        else:
+            results = self._map(lambda shard: self._snapshot_shard(shard, sample),
+                                self._shard(processes, self.workers))
+            for shard, snapshotShard in results:
+                for proc, snap in zip(shard, snapshotShard):
+                    if snap is not None:
+                        snapshots[proc.pid()] = snap
+
+        gone = {proc.pid() for proc in processes} - snapshots.keys()
+        self.last_tick_time = time.perf_counter() - start
+        record('collector.collect', self.last_tick_time)
+        return snapshots, gone
+
+    def _footprint_shard(self, shard):
+        footprints = {}
+        for proc in shard:
+            try:
+                footprints[proc.pid()] = proc.memory_footprint()
+            except self.PROCESS_GONE_ERRORS + (PermissionError,):
+                # smaps_rollup needs ptrace access to the process
+                continue
+        return footprints
+
+    def collect_footprints(self, processes):
+        # returns a dict of pid -> Process.Footprint for the processes whose
+        # smaps_rollup could be read
+        footprints = {}
+        for shard in self._map(self._footprint_shard, self._shard(processes, self.workers)):
+            footprints.update(shard)
+        return footprints
+
+    def shutdown(self):
+        if self._threads:
+            self._threads.shutdown(wait=False)
+        if self._parsers:
+            self._parsers.shutdown(wait=False)
@@ -0,0 +1,162 @@
+import os
+import threading
+from collections import namedtuple
+from .procutil import ProcInfoFileName
+
+# length of the substrings the index is keyed on. queries shorter than this
+# are answered by scanning the distinct names instead
+GRAM_SIZE = 3
+
+
+class HandleIndex(object):
+    Handle = namedtuple('Handle', ['pid', 'type', 'name'])
+    LIBRARY_TYPE = 'Shared Library'
+
+    # what was indexed for a process: its fd signature (see _fd_signature)
+    # and (type, name) descriptors, the key its libraries were read with
+    # (anything that changes when its mappings change), the libraries and
+    # the name ids it contributed to the index
+    IndexedProc = namedtuple('IndexedProc', ['fds', 'descriptors', 'maps_key',
+                                             'libraries', 'ids'])
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._procs = {}
+
+        # every distinct handle name is stored once and referred to by id
+        self._name_ids = {}
+        self._names = {}
+        self._next_id = 0
+
+        # n-gram -> ids of the names containing it
+        self._grams = {}
+
+        # name id -> {pid: [types]}. a name no process refers to anymore
+        # (closed sockets, deleted files) is dropped from the index
+        self._owners = {}
+
+    @staticmethod
+    def _name_grams(name):
+        return {name[i:i + GRAM_SIZE] for i in range(len(name) - GRAM_SIZE + 1)}
+
+    def _acquire(self, name, pid, handle_type):
+        name_id = self._name_ids.get(name)
+        if name_id is None:
+            name_id = self._next_id
+            self._next_id += 1
+            self._name_ids[name] = name_id
+            self._names[name_id] = name
+            self._owners[name_id] = {}
+            for gram in self._name_grams(name):
+                self._grams.setdefault(gram, set()).add(name_id)
+        self._owners[name_id].setdefault(pid, []).append(handle_type)
+        return name_id
+
+    def _release(self, name_id, pid):
+        owners = self._owners[name_id]
+        owners.pop(pid, None)
+        if owners:
+            return
+        name = self._names.pop(name_id)
+        del self._name_ids[name]
+        del self._owners[name_id]
+        for gram in self._name_grams(name):
+            ids = self._grams[gram]
+            ids.discard(name_id)
+            if not ids:
+                del self._grams[gram]
+
+    def _set_handles(self, pid, old_ids, handles):
+        for name_id in set(old_ids):
+            self._release(name_id, pid)
+        return [self._acquire(name, pid, handle_type) for handle_type, name in handles]
+
+    @staticmethod
+    def _fd_signature(fd_dir):
+        # every fd number with where it links to, so an fd closed and its
+        # number reused for another file is noticed. the links are read, not
+        # followed, so a hung mount cannot block the refresh
+        signature = []
+        dir_fd = os.open(fd_dir, os.O_RDONLY)
+        try:
+            for name in os.listdir(dir_fd):
+                try:
+                    target = os.readlink(name, dir_fd=dir_fd)
+                except OSError:
+                    # closed after the listing
+                    target = None
+                signature.append((name, target))
+        finally:
+            os.close(dir_fd)
+        return frozenset(signature)
+
+    def refresh_process(self, proc, maps_key):
+        # re-indexes proc if its fd signature or its maps_key changed since
+        # it was last indexed. fds are only readlink'ed when the signature
+        # changes and the maps file is only parsed when maps_key does
+        pid = proc.pid()
+        entry = self._procs.get(pid)
+        try:
+            try:
+                fds = self._fd_signature(proc.get_full_path(ProcInfoFileName.FD))
+            except PermissionError:
+                fds = None
+            if entry and entry.fds == fds and entry.maps_key == maps_key:
+                return
+
+            descriptors = entry.descriptors if entry and entry.fds == fds else None
+            if descriptors is None:
+                try:
+                    descriptors = [(fd.type, fd.name) for fd in proc.descriptors()] if fds else []
+                except PermissionError:
+                    descriptors = []
+            libraries = entry.libraries if entry and entry.maps_key == maps_key else None
+            if libraries is None:
+                try:
+                    libraries = [(self.LIBRARY_TYPE, name) for name in proc.libraries()]
+                except PermissionError:
+                    libraries = []
+        except OSError:
+            # the process exited, the refresher will remove it, or its
+            # files could not be read this time
+            return
+
+        with self._lock:
+            old_ids = self._procs.pop(pid).ids if pid in self._procs else []
+            ids = self._set_handles(pid, old_ids, descriptors + libraries)
+            self._procs[pid] = HandleIndex.IndexedProc(fds, descriptors, maps_key, libraries, ids)
+
+    def remove_process(self, pid):
+        with self._lock:
+            entry = self._procs.pop(pid, None)
+            if entry:
+                self._set_handles(pid, entry.ids, [])
+
+    def indexed_pids(self):
+        with self._lock:
+            return set(self._procs)
+
+    def search(self, substr):
+        # returns a Handle for every handle or library whose name contains
+        # substr. candidates come from the n-gram sets of substr and are
+        # then checked with a plain substring test
+        with self._lock:
+            if len(substr) < GRAM_SIZE:
+                candidates = self._names.keys()
+            else:
+                candidates = None
+                for gram in self._name_grams(substr):
+                    ids = self._grams.get(gram)
+                    if not ids:
+                        return []
+                    candidates = set(ids) if candidates is None else candidates & ids
+                    if not candidates:
+                        return []
+            results = []
+            for name_id in candidates:
+                name = self._names[name_id]
+                if substr in name:
+                    for pid, types in self._owners[name_id].items():
+                        results.extend(HandleIndex.Handle(pid, handle_type, name)
+                                       for handle_type in types)
+            return results
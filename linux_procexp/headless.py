@@ -0,0 +1,113 @@
+import json
+import sys
+import time
+from .procutil import Process, ProcUtil
+from .collector import ProcCollector
+from .proccolumns import ProcColumns
+
+
+class SnapshotStreamer(object):
+    # samples every process without Qt and writes one JSON object per
+    # process per tick, e.g. {"t":1700000000.0,"pid":1,"name":"systemd",...}
+    FIELDS = Process.Snapshot._fields
+
+    def __init__(self, output, fields=None, changed_only=False, workers=1, top=0, top_by='cpu'):
+        self.output = output
+        self.fields = fields or self.FIELDS
+        unknown = set(self.fields) - set(self.FIELDS)
+        if unknown:
+            raise ValueError('unknown fields: {}'.format(', '.join(sorted(unknown))))
+        self.changed_only = changed_only
+        if top_by not in ProcColumns.COLUMNS:
+            raise ValueError('unknown column: {}'.format(top_by))
+        # only the top processes by top_by are written when top is set
+        self.top = top
+        self.top_by = top_by
+        self.collector = ProcCollector(workers)
+
+        # pid -> Process, and the cpu % and mem % of each computed by
+        # columns against the previous tick
+        self.processes = {}
+        self.columns = ProcColumns()
+        self.starttimes = {}
+        # pid -> values written last, only used when changed_only is set
+        self.last_values = {}
+
+    def tick(self):
+        sample = ProcUtil.system_sample()
+        now = round(time.time(), 3)
+
+        for pid in ProcUtil.pids():
+            if pid not in self.processes:
+                try:
+                    self.processes[pid] = Process(pid)
+                except ValueError:
+                    continue
+
+        snapshots, gone = self.collector.collect(list(self.processes.values()), sample)
+        lines = []
+        for pid in gone:
+            del self.processes[pid]
+            self.starttimes.pop(pid, None)
+            self.columns.release(pid)
+            if self.changed_only and self.last_values.pop(pid, None) is not None:
+                lines.append(self._dumps({'t': now, 'pid': pid, 'exited': True}))
+
+        for pid, snap in snapshots.items():
+            if self.starttimes.get(pid, snap.starttime) != snap.starttime:
+                # a recycled pid starts over without the old baselines
+                self.columns.release(pid)
+            self.starttimes[pid] = snap.starttime
+            self.columns.store(pid, snap)
+        self.columns.compute(sample)
+        pending = self.columns.pending
+        pids = self.columns.top(self.top_by, self.top, pending) if self.top else snapshots
+
+        for pid in pids:
+            snap = snapshots.get(pid)
+            if snap is None:
+                continue
+            slot = self.columns.slots[pid]
+            snap = snap._replace(cpu=pending['cpu'][slot], mem=pending['mem'][slot])
+            values = [getattr(snap, field) for field in self.fields]
+            if self.changed_only:
+                if self.last_values.get(pid) == values:
+                    continue
+                self.last_values[pid] = values
+            record = {'t': now, 'pid': pid}
+            record.update(zip(self.fields, values))
+            lines.append(self._dumps(record))
+
+        if lines:
+            self.output.write('\n'.join(lines) + '\n')
+            self.output.flush()
+
+    @staticmethod
+    def _dumps(record):
+        return json.dumps(record, separators=(',', ':'))
+
+    def run(self, interval, count=0):
+        ticks = 0
+        try:
+            while not count or ticks < count:
+                start = time.monotonic()
+                self.tick()
+                ticks += 1
+                if not count or ticks < count:
+                    time.sleep(max(0, interval - (time.monotonic() - start)))
+        finally:
+            self.collector.shutdown()
+
+
+def collect(args):
+    output = open(args.output, 'a') if args.output else sys.stdout
+    fields = args.fields.split(',') if args.fields else None
+    try:
+        streamer = SnapshotStreamer(output, fields, args.changed_only, args.workers,
+                                    args.top, args.top_by)
+        streamer.run(args.interval, args.count)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if output is not sys.stdout:
+            output.close()
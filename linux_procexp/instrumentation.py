@@ -0,0 +1,78 @@
+import atexit
+import functools
+import os
+import sys
+import threading
+import time
+
+# instrumentation is switched on by setting LINUX_PROCEXP_STATS or passing
+# --stats on the command line. the value of LINUX_PROCEXP_STATS can be a file
+# path to write the report to, otherwise it is written to stderr on exit.
+# this is decided once at import time so that when it is off, timed() hands
+# back the undecorated function and the hot paths do not pay anything
+STATS_ENV_VAR = 'LINUX_PROCEXP_STATS'
+STATS_FLAG = '--stats'
+
+enabled = bool(os.environ.get(STATS_ENV_VAR)) or STATS_FLAG in sys.argv
+
+# name -> [call count, total seconds, max seconds]
+_stats = {}
+_lock = threading.Lock()
+
+
+def record(name, elapsed=0.0, count=1):
+    if not enabled:
+        return
+    with _lock:
+        stat = _stats.get(name)
+        if stat is None:
+            _stats[name] = [count, elapsed, elapsed]
+        else:
+            stat[0] += count
+            stat[1] += elapsed
+            if elapsed > stat[2]:
+                stat[2] = elapsed
+
+
+def timed(name):
+    def decorator(func):
+        if not enabled:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def stats():
+    with _lock:
+        return {name: tuple(stat) for name, stat in _stats.items()}
+
+
+def report(stream=None):
+    lines = ['{:<32} {:>10} {:>12} {:>10} {:>10}'.format(
+        'name', 'calls', 'total ms', 'avg us', 'max ms')]
+    for name, (count, total, maximum) in sorted(stats().items()):
+        lines.append('{:<32} {:>10} {:>12.1f} {:>10.1f} {:>10.2f}'.format(
+            name, count, total * 1000, total / count * 1000000, maximum * 1000))
+    (stream or sys.stderr).write('\n'.join(lines) + '\n')
+
+
+def _report_on_exit():
+    path = os.environ.get(STATS_ENV_VAR, '')
+    # LINUX_PROCEXP_STATS=1 (or only --stats) means stderr
+    if path and path != '1':
+        with open(path, 'w') as f:
+            report(f)
+    else:
+        report()
+
+
+if enabled:
+    atexit.register(_report_on_exit)
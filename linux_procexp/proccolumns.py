@@ -0,0 +1,167 @@
+import heapq
+from array import array
+
+
+class ProcColumns(object):
+    # numeric columns of the process table, each stored in one contiguous
+    # array indexed by a per-pid slot. the refresh thread writes into the
+    # pending arrays and hands a copy of them (snapshot) to the GUI thread
+    # with every delta, which reads the last one it published. the same
+    # way ProcessNode has tempProperties and properties
+    COLUMNS = {
+        'cpu': 'd',
+        'mem': 'd',
+        'rss': 'q',
+        'vsize': 'q',
+        'nice': 'l',
+        'priority': 'l',
+        # utime + stime in jiffies
+        'work': 'q',
+        # smaps_rollup footprint, only filled in when it is being read
+        'pss': 'q',
+        'swap': 'q',
+        'shared_clean': 'q',
+        'shared_dirty': 'q',
+        'private_clean': 'q',
+        'private_dirty': 'q',
+    }
+
+    def __init__(self, capacity=1024):
+        self.capacity = capacity
+        self.slots = {}
+        self.pids = array('l', bytes(array('l').itemsize * capacity))
+        self._free = []
+        self._next_slot = 0
+
+        self.pending = {name: self._zeros(code, capacity) for name, code in self.COLUMNS.items()}
+        self.current = {name: self._zeros(code, capacity) for name, code in self.COLUMNS.items()}
+        self.current['pid'] = self._zeros('l', capacity)
+
+        # the last snapshot taken, what the view shows once it has caught
+        # up. the refresh thread compares pending against it rather than
+        # against current, which belongs to the GUI thread
+        self.emitted = self.current
+
+        # cpu % baselines: the work and total system jiffies of each slot
+        # when its cpu % was last computed
+        self._last_work = self._zeros('q', capacity)
+        self._last_total = self._zeros('q', capacity)
+
+        # slots stored since the last compute()
+        self._stored = []
+
+    @staticmethod
+    def _zeros(code, count):
+        return array(code, bytes(array(code).itemsize * count))
+
+    def _grow(self):
+        extra = self.capacity
+        for name, arr in self.pending.items():
+            arr.extend(self._zeros(self.COLUMNS[name], extra))
+        for arr in (self.pids, self._last_work, self._last_total):
+            arr.extend(self._zeros(arr.typecode, extra))
+        self.capacity += extra
+
+    def slot(self, pid):
+        try:
+            return self.slots[pid]
+        except KeyError:
+            pass
+
+        if self._free:
+            slot = self._free.pop()
+        else:
+            if self._next_slot == self.capacity:
+                self._grow()
+            slot = self._next_slot
+            self._next_slot += 1
+
+        # a new process has no baseline so its first cpu % is its
+        # average since boot, as with Process.cpu_percent
+        self._last_work[slot] = 0
+        self._last_total[slot] = 0
+        self.pids[slot] = pid
+        self.slots[pid] = slot
+        return slot
+
+    def release(self, pid):
+        slot = self.slots.pop(pid, None)
+        if slot is not None:
+            self.pids[slot] = 0
+            self._free.append(slot)
+
+    def store(self, pid, snap):
+        slot = self.slot(pid)
+        pending = self.pending
+        pending['rss'][slot] = snap.rss
+        pending['vsize'][slot] = snap.vsize
+        pending['nice'][slot] = snap.nice
+        pending['priority'][slot] = snap.priority
+        if snap.proc_work is None:
+            # a snapshot without the work it was computed from, e.g. one
+            # replayed from a recording, keeps its cpu % and mem %
+            pending['cpu'][slot] = snap.cpu
+            pending['mem'][slot] = snap.mem
+            return slot
+        pending['work'][slot] = snap.proc_work
+        self._stored.append(slot)
+        return slot
+
+    def store_footprint(self, pid, footprint):
+        slot = self.slot(pid)
+        pending = self.pending
+        for column, value in zip(footprint._fields, footprint):
+            pending[column][slot] = value
+
+    def compute(self, sample):
+        # cpu % and mem % for every slot stored since the last call, in one
+        # pass over the arrays. the values are rounded the way they are shown
+        # so unchanged cells can be detected by comparing the arrays
+        cpu = self.pending['cpu']
+        mem = self.pending['mem']
+        rss = self.pending['rss']
+        work = self.pending['work']
+        last_work = self._last_work
+        last_total = self._last_total
+        total = sample.total_work
+        mem_total = sample.mem_total
+        for slot in self._stored:
+            elapsed = total - last_total[slot]
+            cpu[slot] = round((work[slot] - last_work[slot]) / elapsed * 100, 2) if elapsed else 0.0
+            mem[slot] = round(rss[slot] / mem_total * 100, 2)
+            last_work[slot] = work[slot]
+            last_total[slot] = total
+        self._stored = []
+
+    def snapshot(self):
+        # called on the refresh thread once a tick is complete. slicing
+        # copies the whole array in one go. the pid of each slot goes along
+        # as 'pid' for the orderings below
+        self.emitted = {name: arr[:] for name, arr in self.pending.items()}
+        self.emitted['pid'] = self.pids[:]
+        return self.emitted
+
+    def publish(self, snapshot):
+        # called on the GUI thread with a snapshot, which nothing writes to
+        self.current = snapshot
+
+    def value(self, column, slot):
+        return self.current[column][slot]
+
+    def sorted_slots(self, column, slots, reverse=False, arrays=None):
+        # slots ordered by column and then by pid, as ProcessNode.sortKey
+        # orders them. both sorts take their keys straight from the arrays
+        # (current unless given) rather than calling back into python.
+        # equal values keep the pid order, reversed or not
+        arrays = arrays or self.current
+        order = sorted(slots, key=arrays.get('pid', self.pids).__getitem__, reverse=reverse)
+        order.sort(key=arrays[column].__getitem__, reverse=reverse)
+        return order
+
+    def top(self, column, count, arrays=None):
+        # the pids of the count processes with the largest values of column,
+        # ties in no particular order
+        arrays = arrays or self.current
+        pids = arrays.get('pid', self.pids)
+        return [pids[slot] for slot in
+                heapq.nlargest(count, self.slots.values(), key=arrays[column].__getitem__)]
@@ -0,0 +1,193 @@
+import errno
+import os
+import select
+import socket
+import struct
+from .procutil import Process, ProcUtil
+from .instrumentation import record
+
+# linux/netlink.h, linux/connector.h and linux/cn_proc.h
+NETLINK_CONNECTOR = 11
+NLMSG_DONE = 3
+CN_IDX_PROC = 1
+CN_VAL_PROC = 1
+PROC_CN_MCAST_LISTEN = 1
+PROC_CN_MCAST_IGNORE = 2
+
+PROC_EVENT_NONE = 0
+PROC_EVENT_FORK = 0x00000001
+PROC_EVENT_EXEC = 0x00000002
+PROC_EVENT_EXIT = 0x80000000
+
+# struct nlmsghdr, struct cn_msg and the head of struct proc_event
+_NLMSGHDR = struct.Struct('=IHHII')
+_CN_MSG = struct.Struct('=IIIIHH')
+_EVENT_HEAD = struct.Struct('=IIQ')
+# the first members of event_data's fork, exec, exit and ack variants
+_FORK = struct.Struct('=IIII')
+_PIDS = struct.Struct('=II')
+_ACK = struct.Struct('=I')
+
+_EVENT_OFFSET = _NLMSGHDR.size + _CN_MSG.size
+_DATA_OFFSET = _EVENT_OFFSET + _EVENT_HEAD.size
+
+
+class PollingPidSource(object):
+    # the live pids are whatever is listed in /proc at the time of update()
+    name = 'poll'
+
+    def __init__(self):
+        # pids exec'ing since the last update(). polling cannot tell, nor
+        # see the processes living between two updates
+        self.execed = set()
+        self.live = set()
+        self.short_lived = 0
+        self.overflows = 0
+
+    def update(self):
+        self.live = set(ProcUtil.pids())
+        return self.live
+
+    def close(self):
+        pass
+
+
+class NetlinkPidSource(object):
+    # keeps the set of live pids up to date from the kernel's fork, exec and
+    # exit events instead of listing /proc. /proc is only listed when the
+    # source is opened and again if the socket overflowed and events were
+    # lost. needs CAP_NET_ADMIN and the initial pid namespace, otherwise
+    # the constructor raises OSError
+    name = 'netlink'
+
+    # the socket buffer has to hold every event of one refresh interval
+    RECEIVE_BUFFER = 4 * 1024 * 1024
+    # how long to wait for the kernel to acknowledge the subscription
+    ACK_TIMEOUT = 0.5
+
+    def __init__(self):
+        self._sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_CONNECTOR)
+        try:
+            self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.RECEIVE_BUFFER)
+            self._sock.bind((0, CN_IDX_PROC))
+            self._subscribe(PROC_CN_MCAST_LISTEN)
+        except OSError:
+            self._sock.close()
+            raise
+        self._sock.setblocking(False)
+
+        self.execed = set()
+        # processes that were created and exited between two updates, they
+        # never get a row but are counted
+        self.short_lived = 0
+        self.overflows = 0
+
+        # listed after subscribing so nothing started in between is missed
+        self.live = set(ProcUtil.pids())
+
+    def _subscribe(self, op):
+        payload = struct.pack('=I', op)
+        cn_msg = _CN_MSG.pack(CN_IDX_PROC, CN_VAL_PROC, 0, 0, len(payload), 0)
+        length = _NLMSGHDR.size + len(cn_msg) + len(payload)
+        self._sock.send(_NLMSGHDR.pack(length, NLMSG_DONE, 0, 0, os.getpid()) + cn_msg + payload)
+
+        # the kernel answers with an ack unless the caller is outside the
+        # initial namespaces, where it silently sends no events at all
+        if op != PROC_CN_MCAST_LISTEN:
+            return
+        while True:
+            readable, _, _ = select.select([self._sock], [], [], self.ACK_TIMEOUT)
+            if not readable:
+                raise OSError(errno.ETIMEDOUT, 'no proc connector acknowledgement')
+            data = self._sock.recv(4096)
+            what, _, _ = _EVENT_HEAD.unpack_from(data, _EVENT_OFFSET)
+            if what == PROC_EVENT_NONE:
+                err, = _ACK.unpack_from(data, _DATA_OFFSET)
+                if err:
+                    raise OSError(err, os.strerror(err))
+                return
+
+    def _drain(self):
+        # returns the events queued on the socket as (what, pid) tuples,
+        # or None if the socket overflowed and some were dropped
+        events = []
+        recv = self._sock.recv
+        while True:
+            try:
+                data = recv(65536)
+            except BlockingIOError:
+                return events
+            except OSError as e:
+                if e.errno == errno.ENOBUFS:
+                    return None
+                raise
+
+            # one datagram can hold several netlink messages
+            offset = 0
+            while offset + _NLMSGHDR.size <= len(data):
+                length = _NLMSGHDR.unpack_from(data, offset)[0]
+                if length < _NLMSGHDR.size:
+                    break
+                what, _, _ = _EVENT_HEAD.unpack_from(data, offset + _NLMSGHDR.size + _CN_MSG.size)
+                start = offset + _DATA_OFFSET
+                if what == PROC_EVENT_FORK:
+                    _, _, child_pid, child_tgid = _FORK.unpack_from(data, start)
+                    # a new thread rather than a new process
+                    if child_pid == child_tgid:
+                        events.append((what, child_pid))
+                elif what == PROC_EVENT_EXEC or what == PROC_EVENT_EXIT:
+                    pid, tgid = _PIDS.unpack_from(data, start)
+                    if pid == tgid:
+                        events.append((what, pid))
+                offset += (length + 3) & ~3
+
+    def update(self):
+        events = self._drain()
+        if events is None:
+            # events were lost, so start over from a listing of /proc
+            self.overflows += 1
+            while self._drain() is None:
+                pass
+            self.execed = set()
+            self.live = set(ProcUtil.pids())
+            return self.live
+
+        live = self.live
+        born = set()
+        execed = set()
+        for what, pid in events:
+            if what == PROC_EVENT_FORK:
+                live.add(pid)
+                born.add(pid)
+            elif what == PROC_EVENT_EXEC:
+                live.add(pid)
+                execed.add(pid)
+            else:
+                live.discard(pid)
+                execed.discard(pid)
+                if pid in born:
+                    self.short_lived += 1
+                    born.discard(pid)
+        self.execed = execed
+        record('events.received', count=len(events))
+        return live
+
+    def close(self):
+        try:
+            self._subscribe(PROC_CN_MCAST_IGNORE)
+        except OSError:
+            pass
+        self._sock.close()
+
+
+def open_pid_source(use_events=True):
+    # the netlink source when it can be used, polling otherwise. the kernel
+    # only reports the real /proc so another proc root always polls
+    if use_events and os.path.realpath(Process.PROC_PATH) == '/proc':
+        try:
+            return NetlinkPidSource()
+        except (OSError, AttributeError):
+            # no AF_NETLINK, no CAP_NET_ADMIN or not in the initial pid
+            # namespace
+            pass
+    return PollingPidSource()
@@ -0,0 +1,98 @@
+import fnmatch
+import re
+import shlex
+
+# text fields are compared case-folded against a glob (name:java*) or, when
+# there is no wildcard, a substring (user:postgres). numeric fields take a
+# comparison (rss>1G, cpu>=5, pid=42) with an optional size suffix
+TEXT_FIELDS = ('name', 'user', 'cmdline')
+NUMERIC_FIELDS = ('pid', 'cpu', 'mem', 'rss', 'vsize', 'pss', 'swap', 'nice', 'priority')
+SIZE_SUFFIXES = {'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3, 't': 1024 ** 4}
+
+_COMPARISON = re.compile(r'^([a-z]+)(>=|<=|!=|>|<|=)(.+)$')
+_OPERATORS = {
+    '>': lambda value, limit: value > limit,
+    '<': lambda value, limit: value < limit,
+    '>=': lambda value, limit: value >= limit,
+    '<=': lambda value, limit: value <= limit,
+    '=': lambda value, limit: value == limit,
+    '!=': lambda value, limit: value != limit,
+}
+
+
+class FilterSyntaxError(ValueError):
+    pass
+
+
+def _parse_number(text):
+    text = text.strip().rstrip('%').lower()
+    if text.endswith('b'):
+        text = text[:-1]
+    multiplier = 1
+    if text and text[-1] in SIZE_SUFFIXES:
+        multiplier = SIZE_SUFFIXES[text[-1]]
+        text = text[:-1]
+    try:
+        return float(text) * multiplier
+    except ValueError:
+        raise FilterSyntaxError('not a number: {}'.format(text)) from None
+
+
+def _text_matcher(pattern):
+    pattern = pattern.casefold()
+    if any(char in pattern for char in '*?['):
+        return re.compile(fnmatch.translate(pattern)).match
+    return lambda value: pattern in value
+
+
+class ProcFilter(object):
+    # a parsed query. every term has to match for a process to match, a
+    # term starting with - has to not match. a bare word is looked for in
+    # the name. values are asked for through a lookup(field) callable,
+    # text fields case-folded, so the keys can be computed once per
+    # process and shared by every query
+    def __init__(self, text):
+        self.text = text
+        self.terms = []
+        try:
+            words = shlex.split(text)
+        except ValueError as e:
+            raise FilterSyntaxError(str(e)) from None
+        for word in words:
+            negate = word.startswith('-') and len(word) > 1
+            if negate:
+                word = word[1:]
+            self.terms.append((negate,) + self._parse_term(word))
+
+        # the fields the query looks at, cmdline is only read if used
+        self.fields = {field for _, field, _ in self.terms}
+
+    @staticmethod
+    def _parse_term(word):
+        comparison = _COMPARISON.match(word)
+        if comparison:
+            field, operator, value = comparison.groups()
+            if field not in NUMERIC_FIELDS:
+                raise FilterSyntaxError('{} cannot be compared'.format(field))
+            limit = _parse_number(value)
+            compare = _OPERATORS[operator]
+            return field, lambda value: compare(value, limit)
+
+        field, colon, pattern = word.partition(':')
+        if not colon:
+            return 'name', _text_matcher(word)
+        if field in TEXT_FIELDS:
+            return field, _text_matcher(pattern)
+        if field in NUMERIC_FIELDS:
+            limit = _parse_number(pattern)
+            return field, lambda value: value == limit
+        raise FilterSyntaxError('unknown field: {}'.format(field))
+
+    def __bool__(self):
+        return bool(self.terms)
+
+    def matches(self, lookup):
+        for negate, field, matcher in self.terms:
+            if bool(matcher(lookup(field))) == negate:
+                return False
+        return True
@@ -0,0 +1,103 @@
+import csv
+from array import array
+
+
+class ProcHistory(object):
+    # the last depth values of a few columns for every tracked process, in
+    # ring buffers preallocated up front. each metric is one flat array of
+    # capacity * depth values, a process owning depth consecutive ones at
+    # slot * depth. all rings advance together, one position per record(),
+    # so a tick costs one store per process and metric and the memory used
+    # is fixed: capacity * depth * (bytes of one sample of every metric)
+    METRICS = {
+        # cpu % does not need double precision
+        'cpu': 'f',
+        'rss': 'q',
+    }
+
+    def __init__(self, depth=120, max_bytes=8 * 1024 * 1024):
+        self.depth = depth
+        sample_size = sum(array(code).itemsize for code in self.METRICS.values())
+        self.capacity = max(1, max_bytes // (depth * sample_size))
+
+        self.rings = {name: array(code, bytes(array(code).itemsize * self.capacity * depth))
+                      for name, code in self.METRICS.items()}
+        # wall clock time of each position
+        self.times = array('d', bytes(array('d').itemsize * depth))
+
+        # pid -> slot and the record count when the pid started being
+        # tracked, so a younger process' older positions are not shown
+        self.slots = {}
+        self.first = {}
+        self._free = list(range(self.capacity - 1, -1, -1))
+
+        # number of record() calls so far. the newest values are at
+        # position (count - 1) % depth
+        self.count = 0
+
+    def track(self, pid):
+        # once every slot is taken, processes already tracked keep theirs
+        # and new ones go without history until others exit
+        slot = self.slots.get(pid)
+        if slot is None and self._free:
+            slot = self.slots[pid] = self._free.pop()
+            self.first[pid] = self.count
+        return slot
+
+    def release(self, pid):
+        slot = self.slots.pop(pid, None)
+        if slot is not None:
+            del self.first[pid]
+            self._free.append(slot)
+
+    def record(self, columns, timestamp):
+        # stores the pending ProcColumns values of every process in columns
+        depth = self.depth
+        position = self.count % depth
+        offsets = []
+        slots = self.slots
+        for pid, column_slot in columns.slots.items():
+            slot = slots.get(pid)
+            if slot is None:
+                slot = self.track(pid)
+                if slot is None:
+                    continue
+            offsets.append((slot * depth + position, column_slot))
+        for name, ring in self.rings.items():
+            values = columns.pending[name]
+            for offset, column_slot in offsets:
+                ring[offset] = values[column_slot]
+        self.times[position] = timestamp
+        self.count += 1
+
+    def length(self, pid):
+        return min(self.count - self.first.get(pid, self.count), self.depth)
+
+    def series(self, metric, pid):
+        # the recorded values of pid, oldest first
+        slot = self.slots.get(pid)
+        if slot is None:
+            return []
+        length = self.length(pid)
+        start = slot * self.depth
+        ring = self.rings[metric]
+        end = self.count % self.depth
+        values = ring[start + end:start + self.depth] + ring[start:start + end]
+        return values[len(values) - length:].tolist()
+
+    def timestamps(self, pid):
+        length = self.length(pid)
+        end = self.count % self.depth
+        times = self.times[end:] + self.times[:end]
+        return times[len(times) - length:].tolist()
+
+    def export(self, pid, stream):
+        # writes the history of pid as csv, one row per recorded tick
+        writer = csv.writer(stream)
+        metrics = sorted(self.METRICS)
+        writer.writerow(['time'] + metrics)
+        columns = [self.series(metric, pid) for metric in metrics]
+        # single precision values are written the way they are shown
+        columns = [[round(value, 2) for value in values] if self.METRICS[metric] == 'f'
+                   else values for metric, values in zip(metrics, columns)]
+        writer.writerows(zip(self.timestamps(pid), *columns))
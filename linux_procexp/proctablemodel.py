@@ -1,20 +1,68 @@
-import logging
-import re
+import time
 from collections import namedtuple
 from PyQt4.QtCore import QAbstractItemModel, Qt, QModelIndex, QObject, \
      QTimer, pyqtSignal, pyqtSlot
 from .procutil import Process, ProcUtil
-
-LOG_FILENAME = 'linux-procexp.log'
-logging.basicConfig(filename=LOG_FILENAME, level=logging.DEBUG, filemode='w')
+from .instrumentation import timed
+from .collector import ProcCollector
+from .proccolumns import ProcColumns
+from .handleindex import HandleIndex
+from .scheduler import RefreshScheduler
+from .procevents import open_pid_source
+from .threadsampler import ThreadSampler
+from .prochistory import ProcHistory
+from .recording import Row, RecordedProcess
+from .agent import AgentConnection, ALL_FIELDS, DEFAULT_ROW, STRUCTURE_FIELDS, field_mask
 
 class ProcessNode(object):
-    def __init__(self, pid, parent=None):
+    # columns whose values live in the model's ProcColumns store. the
+    # remaining columns (name, pid and user) are kept in properties
+    NUMERIC_COLUMNS = {1: 'cpu', 2: 'mem', 4: 'rss', 6: 'nice', 7: 'priority',
+                       8: 'pss', 9: 'swap', 10: 'shared_clean', 11: 'shared_dirty',
+                       12: 'private_clean', 13: 'private_dirty'}
+
+    # columns holding a size in bytes, shown in MB
+    SIZE_COLUMNS = frozenset((4, 8, 9, 10, 11, 12, 13))
+
+    # columns drawn as a sparkline of the model's ProcHistory. they have
+    # no text and sort by the latest value
+    HISTORY_COLUMNS = {14: 'cpu', 15: 'rss'}
+
+    # the text fields of a procfilter.ProcFilter found in properties,
+    # cmdline is read by the refresher (see readCmdline)
+    FILTER_COLUMNS = {'name': 0, 'user': 5}
+
+    def __init__(self, pid, parent=None, sample=None, process=None, snapshot=None, columns=None):
+        # procTable is keyed on the pid alone, as no two running processes
+        # share one, but a node only stands for the process with its
+        # starttime (see identity). the refresher replaces the node when
+        # the pid is reused
         self.pid = pid
         self.children = []
         self.parent = parent
-        self.tempProperties = []
-        self.properties = []
+
+        # position of this node in its parent's children. it is kept up to
+        # date by the parent on every insert, remove and sort so looking up
+        # the row of a node does not need to scan its siblings
+        self.row = 0
+
+        # the value this node was last ordered by while the model is sorted,
+        # see ProcTableModel.resortRows
+        self.sortKeyCache = None
+
+        # case-folded text fields for the filter, filled in by filterValue
+        # as a query asks for them and dropped when the properties change
+        self.filterKeys = {}
+
+        # the case-folded command line, read on the refresh thread while a
+        # filter looks at it and None until then or after an exec
+        self.cmdline = None
+        self.tempProperties = {}
+        self.properties = {}
+        self.ppid = 0
+        self.starttime = 0
+        self.columns = columns
+        self.slot = -1
 
         if pid == 0:
             # The node with pid = 0 is a dummy node used as the root node
@@ -23,68 +71,212 @@ class ProcessNode(object):
             # daemon does not have init as its ppid
             self.data = None
         else:
-            self.data = Process(pid)
-            self.retrieveProperties()
+            self.data = process or Process(pid)
+            if snapshot is None:
+                self.retrieveProperties(sample)
+            else:
+                self.applySnapshot(snapshot)
             self.assignProperties()
 
     def __len__(self):
         return len(self.children)
 
+    @property
+    def identity(self):
+        return self.pid, self.starttime
+
     def insertChild(self, child):
+        child.row = len(self.children)
         self.children.append(child)
 
+    def setChildren(self, children):
+        self.children = children
+        self.renumberChildren()
+
+    def renumberChildren(self, start=0, end=None):
+        for row in range(start, len(self.children) if end is None else end):
+            self.children[row].row = row
+
+    def hasChild(self, childNode):
+        row = childNode.row
+        return row < len(self.children) and self.children[row] is childNode
+
     def rowOfChild(self, childNode):
-        for i, child in enumerate(self.children):
-            if child == childNode:
-                return i
-        raise ValueError('Node({0}) does not contain child({0})'.format(self.pid))
+        if self.hasChild(childNode):
+            return childNode.row
+        raise ValueError('Node({0}) does not contain child({1})'.format(self.pid, childNode.pid))
 
     def removeChild(self, childNode):
-        self.children.remove(childNode)
+        row = self.rowOfChild(childNode)
+        del self.children[row]
+        self.renumberChildren(row)
 
     def childAtRow(self, row):
         return self.children[row]
 
     def mappedLibraries(self):
-        return {mapped.name for mapped in self.data.memory_maps(resolvedev=False)
-                if re.match('.*\.so.*', mapped.name)}
+        return self.data.libraries()
 
     def descriptors(self):
         return self.data.descriptors()
 
-    def retrieveProperties(self):
-        proc = self.data
+    def retrieveProperties(self, sample=None):
         try:
-            self.tempProperties = [
-                proc.name(),
-                round(proc.cpu_percent(), 2),
-                round(proc.memory_percent(), 2),
-                proc.pid(),
-                "{}M".format(proc.virtual_memory().rss // 1048576),
-                proc.owner().name,
-                proc.nice(),
-                proc.priority()
-            ]
+            snap = self.data.snapshot(sample)
         except FileNotFoundError:
-            self.tempProperties = []
+            self.tempProperties = {}
             raise
+        self.applySnapshot(snap)
+
+    def applySnapshot(self, snap):
+        # the numeric values go to the pending arrays of the column store,
+        # their cpu/mem % is computed for all processes at once by
+        # ProcColumns.compute()
+        if self.tempProperties.get(0) != snap.name:
+            self.cmdline = None
+        self.ppid = snap.ppid
+        self.starttime = snap.starttime
+        self.slot = self.columns.store(self.pid, snap)
+        self.tempProperties = {
+            0: snap.name,
+            3: snap.pid,
+            5: snap.owner
+        }
+
+    @staticmethod
+    def formatField(colIdx, value):
+        if colIdx in ProcessNode.SIZE_COLUMNS:
+            return "{}M".format(value // 1048576)
+        return value
+
+    def changedColumns(self):
+        # returns the first and last column that differ between the
+        # retrieved and the displayed values or None if none do
+        changed = [colIdx for colIdx, new in self.tempProperties.items()
+                   if self.properties.get(colIdx) != new]
+        for colIdx, column in self.NUMERIC_COLUMNS.items():
+            if self.formatField(colIdx, self.columns.pending[column][self.slot]) != \
+                    self.formatField(colIdx, self.columns.emitted[column][self.slot]):
+                changed.append(colIdx)
+        return (min(changed), max(changed)) if changed else None
 
     def assignProperties(self):
+        if self.tempProperties != self.properties:
+            self.filterKeys = {}
         self.properties = self.tempProperties
         return len(self.properties) > 0
 
+    def sortKey(self, colIdx):
+        # typed values rather than what is shown (e.g. rss in bytes, not
+        # '123M'), with the pid breaking ties so the order is stable
+        column = self.NUMERIC_COLUMNS.get(colIdx) or self.HISTORY_COLUMNS.get(colIdx)
+        if column:
+            return self.columns.value(column, self.slot), self.pid
+        return self.properties[colIdx], self.pid
+
     def fields(self, colIdx):
-            return self.properties[colIdx]
+        column = self.NUMERIC_COLUMNS.get(colIdx)
+        if column:
+            return self.formatField(colIdx, self.columns.value(column, self.slot))
+        if colIdx in self.HISTORY_COLUMNS:
+            return ''
+        return self.properties[colIdx]
+
+    def filterValue(self, field):
+        if field == 'pid':
+            return self.properties.get(3, self.pid)
+        if field in self.columns.COLUMNS:
+            return self.columns.value(field, self.slot)
+        if field == 'cmdline':
+            return self.cmdline or ''
+        key = self.filterKeys.get(field)
+        if key is None:
+            value = self.properties.get(self.FILTER_COLUMNS[field], '')
+            key = self.filterKeys[field] = value.casefold()
+        return key
 
 
 class ProcTableModelRefresher(QObject):
-    modelRefresh = pyqtSignal(list)
+    # what changed in the process table during one tick. added and removed
+    # are lists of ProcessNodes, changed is a list of
+    # (ProcessNode, firstColIdx, lastColIdx) for the cells that changed and
+    # columns is the ProcColumns snapshot the model shows them with
+    RefreshDelta = namedtuple('RefreshDelta', ['added', 'removed', 'changed', 'columns'])
+
+    modelRefresh = pyqtSignal(object)
+
+    # emitted after every tick with its wall time in seconds
+    tickFinished = pyqtSignal(float)
+
+    # emitted after every tick with the current effective interval in
+    # milliseconds and the number of ticks skipped so far
+    scheduleChanged = pyqtSignal(int, int)
+
+    # emitted after every tick with the name of the pid source, the number
+    # of processes that came and went between two ticks without a row and
+    # the number of times events were lost (see procevents)
+    pidEventsChanged = pyqtSignal(str, int, int)
 
-    def __init__(self, model, refreshInterval=2000, parent=None):
+    # emitted with the pid whose threads are followed (see setThreadPid)
+    # and a list of ThreadSampler.Thread, on every tick and right away
+    # when the pid changes. pids are qint64 as the ProcTableModelAggregator
+    # keys of remote processes do not fit an int
+    threadsRefreshed = pyqtSignal('qint64', list)
+
+    def __init__(self, model, refreshInterval=2000, parent=None, workers=1, parseProcesses=0,
+                 cpuBudget=0.05, pidEvents=True):
         super().__init__(parent)
         self.procTable = model.procTable
+        self.columns = model.columns
+        self.handleIndex = model.handleIndex
+        self.history = model.history
         self.refreshInterval = refreshInterval
+
+        # reads the processes of a tick, sharded over workers threads
+        # and optionally parseProcesses parser processes
+        self.collector = ProcCollector(workers, parseProcesses)
+
+        # the timer is re-armed after every tick with the delay the
+        # scheduler asks for, which grows while the explorer uses more
+        # than cpuBudget of a cpu, its parser processes included
         self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.scheduler = RefreshScheduler(refreshInterval, cpuBudget,
+                                          helper_cpu_time=lambda: self.collector.parser_cpu_time)
+
+        # the set of live pids, kept from the kernel's fork/exit events when
+        # pidEvents is set and they are available, or by listing /proc
+        self.pidSource = open_pid_source(pidEvents)
+
+        # smaps_rollup is only read while one of the footprint columns
+        # is shown. set from the GUI thread by ProcTableWidget
+        self.readFootprint = False
+
+        # the command line of every process is read while the filter looks
+        # at it, set from the GUI thread by ProcTableWidget
+        self.readCmdline = False
+
+        # pids the view is showing (visible rows and their ancestors), set
+        # from the GUI thread through setVisiblePids. these are re-read on
+        # every tick while every other process is re-read once every
+        # backgroundTicks ticks, a different slice of them on each tick.
+        # an empty set means the view has not said yet so all are read
+        self.visiblePids = frozenset()
+        self.backgroundTicks = 15
+        self.tickCount = 0
+
+        # set when something needs current values for every process, e.g.
+        # sorting, the next tick then reads all of them
+        self.fullRefreshRequested = True
+
+        # a recording.SnapshotRecorder every tick is written to, if any
+        self.recorder = None
+
+        # the process whose threads are read every tick, 0 for none. the
+        # sampler is kept while the view hides the threads so the cpu %
+        # baselines are still there when it shows them again
+        self.threadPid = 0
+        self.threadSampler = None
 
     @property
     def interval(self):
@@ -92,7 +284,8 @@ class ProcTableModelRefresher(QObject):
 
     @interval.setter
     def interval(self, interval):
-        self.timer.start(interval)
+        self.scheduler.set_base_interval(interval)
+        self.timer.start(self.scheduler.interval)
         self.refreshInterval = interval
 
     @pyqtSlot()
@@ -100,33 +293,541 @@ class ProcTableModelRefresher(QObject):
         self.timer.timeout.connect(self.refresh)
         self.timer.start(self.refreshInterval)
 
+    def setVisiblePids(self, pids):
+        self.visiblePids = frozenset(pids)
+
     @pyqtSlot()
-    def refresh(self):
-        for pid, node in list(self.procTable.items()):
+    def requestFullRefresh(self):
+        self.fullRefreshRequested = True
+
+    # milliseconds between the two reads of a newly picked process'
+    # threads, the first one only takes the cpu % baselines
+    THREAD_BASELINE_DELAY = 250
+
+    @pyqtSlot('qint64')
+    def setThreadPid(self, pid):
+        # connected through a queued signal so the threads are read on the
+        # refresh thread, right away and then on every tick. a fresh sample
+        # is taken as the last tick's would leave no time elapsed
+        self.threadPid = pid
+        if not pid:
+            return
+        if self.threadSampler is None or self.threadSampler.pid != pid:
+            self.threadSampler = ThreadSampler(pid)
             try:
-                node.retrieveProperties()
-            except FileNotFoundError:
-                del self.procTable[pid]
+                self.threadSampler.sample(ProcUtil.system_sample())
+            except (FileNotFoundError, ProcessLookupError, PermissionError):
+                pass
+            QTimer.singleShot(self.THREAD_BASELINE_DELAY, self.refreshThreadsNow)
+            return
+        self.refreshThreadsNow()
 
-        newProcNodes = []
-        for pid in ProcUtil.pids():
+    @pyqtSlot()
+    def refreshThreadsNow(self):
+        self.refreshThreads(ProcUtil.system_sample())
+
+    def refreshThreads(self, sample):
+        if not self.threadPid:
+            return
+        try:
+            threads = self.threadSampler.sample(sample)
+        except (FileNotFoundError, ProcessLookupError, PermissionError):
+            threads = []
+        self.threadsRefreshed.emit(self.threadPid, threads)
+
+    def isDue(self, pid):
+        # spreads the background processes over backgroundTicks ticks
+        return pid in self.visiblePids or pid % self.backgroundTicks == \
+            self.tickCount % self.backgroundTicks
+
+    @pyqtSlot()
+    @timed('refresh.tick')
+    def refresh(self):
+        tickStart = time.perf_counter()
+        self.scheduler.tick_started()
+        sample = ProcUtil.system_sample()
+
+        # discovering new processes and noticing exited ones only needs
+        # the set of live pids and covers the whole system on every tick
+        listedPids = self.pidSource.update()
+        newProcesses = []
+        for pid in listedPids:
             if pid not in self.procTable:
-                newNode = ProcessNode(pid)
+                try:
+                    newProcesses.append(Process(pid))
+                except ValueError:
+                    # the process exited between listing /proc and reading it
+                    continue
+
+        # the event source knows which processes exec'd, their names are
+        # read again. polling finds out from a changed comm in snapshot()
+        for pid in self.pidSource.execed:
+            node = self.procTable.get(pid)
+            if node is not None:
+                node.data.forget_static()
+                node.cmdline = None
+
+        fullRefresh = self.fullRefreshRequested or not self.visiblePids
+        self.fullRefreshRequested = False
+        self.tickCount += 1
+        procNodes = [node for node in self.procTable.values() if node.pid in listedPids and
+                     (fullRefresh or self.isDue(node.pid))]
+        snapshots, gone = self.collector.collect(
+            [node.data for node in procNodes] + newProcesses, sample)
+        gone |= self.procTable.keys() - listedPids
+
+        # a pid whose start time changed was reused by a new process since
+        # the last tick. the old node goes and the new process starts over
+        # with a node of its own, keeping none of the old one's baselines
+        recycled = [node for node in procNodes if node.pid not in gone and
+                    snapshots[node.pid].starttime != node.starttime]
+        for node in recycled:
+            procNodes.remove(node)
+            newProcesses.append(node.data)
+
+        removedNodes = []
+        for pid in gone | {node.pid for node in recycled}:
+            node = self.procTable.pop(pid, None)
+            if node is not None:
+                self.columns.release(pid)
+                self.history.release(pid)
+                self.handleIndex.remove_process(pid)
+                ProcUtil.library_cache.discard(pid)
+                removedNodes.append(node)
+
+        for node in procNodes:
+            if node.pid not in gone:
+                node.applySnapshot(snapshots[node.pid])
+
+        newProcNodes = []
+        for proc in newProcesses:
+            if proc.pid() in snapshots:
+                newNode = ProcessNode(proc.pid(), process=proc, snapshot=snapshots[proc.pid()],
+                                      columns=self.columns)
+                self.procTable[newNode.pid] = newNode
+                newProcNodes.append(newNode)
+
+        if self.readFootprint:
+            aliveProcs = [node.data for node in procNodes if node.pid not in gone]
+            aliveProcs += [node.data for node in newProcNodes]
+            for pid, footprint in self.collector.collect_footprints(aliveProcs).items():
+                self.columns.store_footprint(pid, footprint)
+
+        self.columns.compute(sample)
+        self.history.record(self.columns, time.time())
+        if self.recorder is not None:
+            self.recordTick(snapshots, gone)
+        self.updateHandleIndex(snapshots)
+        self.refreshThreads(sample)
+        cmdlineNodes = self.readCmdlines() if self.readCmdline else []
+
+        changedNodes = []
+        for node in procNodes:
+            if node.pid not in gone:
+                changedCols = node.changedColumns()
+                if changedCols:
+                    changedNodes.append((node,) + changedCols)
+
+        # a process whose command line was read has to be filtered again
+        if cmdlineNodes:
+            reported = {node for node, firstCol, lastCol in changedNodes}
+            reported.update(newProcNodes)
+            changedNodes.extend((node, 0, 0) for node in cmdlineNodes if node not in reported)
+
+        self.modelRefresh.emit(
+            ProcTableModelRefresher.RefreshDelta(newProcNodes, removedNodes, changedNodes,
+                                                 self.columns.snapshot()))
+        self.tickFinished.emit(time.perf_counter() - tickStart)
+
+        self.timer.start(self.scheduler.tick_finished())
+        self.scheduleChanged.emit(self.scheduler.interval, self.scheduler.skipped)
+        self.pidEventsChanged.emit(self.pidSource.name, self.pidSource.short_lived,
+                                   self.pidSource.overflows)
+
+    def shutdown(self):
+        # called once the refresh thread has stopped
+        self.pidSource.close()
+        self.collector.shutdown()
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+
+    @timed('refresh.cmdline')
+    def readCmdlines(self):
+        # returns the nodes whose command line was read. a process' command
+        # line is read once and again only after it exec'd
+        read = []
+        for node in self.procTable.values():
+            if node.cmdline is None:
+                try:
+                    node.cmdline = ' '.join(node.data.cmdline()).casefold()
+                except (PermissionError, FileNotFoundError, ProcessLookupError):
+                    node.cmdline = ''
+                read.append(node)
+        return read
+
+    @timed('refresh.record')
+    def recordTick(self, snapshots, gone):
+        # the first record of a recording gets every process, after that
+        # only those read this tick can have changed
+        pids = snapshots.keys() if self.recorder.state else self.procTable.keys()
+        pending = self.columns.pending
+        rows = {}
+        for pid in pids:
+            node = self.procTable.get(pid)
+            if node is None:
+                continue
+            slot = node.slot
+            rows[pid] = Row(node.starttime, node.ppid, node.tempProperties[0],
+                            node.tempProperties[5], pending['cpu'][slot], pending['mem'][slot],
+                            pending['rss'][slot], pending['vsize'][slot], pending['nice'][slot],
+                            pending['priority'][slot])
+        self.recorder.record(time.time(), rows, gone)
+
+    @timed('refresh.handleindex')
+    def updateHandleIndex(self, snapshots):
+        # a process' libraries are only re-read when its start time or
+        # virtual size changed, which is when its mappings may have
+        for pid, snap in snapshots.items():
+            node = self.procTable.get(pid)
+            if node is not None:
+                self.handleIndex.refresh_process(node.data, (snap.starttime, snap.vsize))
+
+
+class ProcTableModelReplayer(QObject):
+    # drives the model from a recording.SnapshotPlayer instead of /proc. it
+    # has the signals and slots of ProcTableModelRefresher so the widgets
+    # can use either, and sends the same RefreshDelta for every tick it
+    # moves to, whether stepping while playing or seeking
+    modelRefresh = pyqtSignal(object)
+    tickFinished = pyqtSignal(float)
+    scheduleChanged = pyqtSignal(int, int)
+    pidEventsChanged = pyqtSignal(str, int, int)
+    threadsRefreshed = pyqtSignal('qint64', list)
+
+    # emitted with the tick shown and its timestamp
+    tickChanged = pyqtSignal(int, float)
+
+    def __init__(self, model, player, refreshInterval=2000, parent=None):
+        super().__init__(parent)
+        self.procTable = model.procTable
+        self.columns = model.columns
+        self.history = model.history
+        self.player = player
+        self.refreshInterval = refreshInterval
+        self.timer = QTimer(self)
+        self.readFootprint = False
+        self.readCmdline = False
+
+        # the tick on screen and pid -> recording.Row of what it shows
+        self.tick = -1
+        self.shown = {}
+
+    @pyqtSlot()
+    def startRefreshTimer(self):
+        self.timer.timeout.connect(self.step)
+        if len(self.player):
+            self.seek(0)
+
+    @pyqtSlot(bool)
+    def setPlaying(self, playing):
+        if playing:
+            self.timer.start(self.refreshInterval)
+        else:
+            self.timer.stop()
+
+    @pyqtSlot()
+    def step(self):
+        if self.tick + 1 < len(self.player):
+            self.seek(self.tick + 1)
+        else:
+            self.timer.stop()
+
+    def setVisiblePids(self, pids):
+        # every process of a tick is in the recording already
+        pass
+
+    @pyqtSlot()
+    def requestFullRefresh(self):
+        pass
+
+    @pyqtSlot('qint64')
+    def setThreadPid(self, pid):
+        # threads are not recorded
+        self.threadsRefreshed.emit(pid, [])
+
+    def shutdown(self):
+        self.player.close()
+
+    @staticmethod
+    def snapshot(pid, row):
+        # no proc_work, the columns keep the recorded cpu % and mem %
+        return Process.Snapshot(pid, row.ppid, row.name, '', row.starttime, None, row.cpu,
+                                row.mem, row.vsize, row.rss, None, row.owner, row.nice,
+                                row.priority, 0)
+
+    @pyqtSlot(int)
+    @timed('replay.seek')
+    def seek(self, tick):
+        tickStart = time.perf_counter()
+        if tick == self.tick:
+            return
+        state = self.player.state(tick)
+        shown = self.shown
+
+        # a pid that was recycled between the two ticks is a new process
+        removedNodes = []
+        for pid, row in list(shown.items()):
+            newRow = state.get(pid)
+            if newRow is None or newRow.starttime != row.starttime:
+                del shown[pid]
+                node = self.procTable.pop(pid)
+                self.columns.release(pid)
+                self.history.release(pid)
+                removedNodes.append(node)
+
+        newProcNodes = []
+        changedNodes = []
+        for pid, row in state.items():
+            oldRow = shown.get(pid)
+            if oldRow == row:
+                continue
+            shown[pid] = row
+            if oldRow is None:
+                newNode = ProcessNode(pid, process=RecordedProcess(pid, row),
+                                      snapshot=self.snapshot(pid, row), columns=self.columns)
                 self.procTable[pid] = newNode
                 newProcNodes.append(newNode)
+            else:
+                node = self.procTable[pid]
+                node.data.row = row
+                node.applySnapshot(self.snapshot(pid, row))
+                changedCols = node.changedColumns()
+                if changedCols:
+                    changedNodes.append((node,) + changedCols)
+
+        self.tick = tick
+        self.modelRefresh.emit(
+            ProcTableModelRefresher.RefreshDelta(newProcNodes, removedNodes, changedNodes,
+                                                 self.columns.snapshot()))
+        self.tickChanged.emit(tick, self.player.timestamp(tick))
+        self.tickFinished.emit(time.perf_counter() - tickStart)
+
+
+class ProcTableModelAggregator(QObject):
+    # drives the model from agent.SnapshotAgents on one or more hosts. it
+    # has the signals and slots of ProcTableModelRefresher, collecting is
+    # left to the agents and every tick only applies what they sent since
+    # the last one. each host is a top level node with its processes below
+    # it. the model is keyed on host << HOST_SHIFT | pid so the pids of
+    # different hosts do not collide, a host's own node being its pid 0
+    modelRefresh = pyqtSignal(object)
+    tickFinished = pyqtSignal(float)
+    scheduleChanged = pyqtSignal(int, int)
+    pidEventsChanged = pyqtSignal(str, int, int)
+    threadsRefreshed = pyqtSignal('qint64', list)
+
+    HOST_SHIFT = 32
+    PID_MASK = (1 << HOST_SHIFT) - 1
+
+    # the agent fields behind each column, the rest are not subscribed to
+    # while their column is hidden
+    COLUMN_FIELDS = {1: 'cpu', 2: 'mem', 4: 'rss', 5: 'owner', 6: 'nice', 7: 'priority',
+                     14: 'cpu', 15: 'rss'}
+
+    def __init__(self, model, addresses, refreshInterval=2000, parent=None):
+        super().__init__(parent)
+        self.procTable = model.procTable
+        self.columns = model.columns
+        self.history = model.history
+        self.addresses = list(addresses)
+        self.refreshInterval = refreshInterval
+        self.timer = QTimer(self)
+        self.readFootprint = False
+        self.readCmdline = False
+
+        # the columns the view shows, set from the GUI thread by
+        # ProcTableWidget. None until it does, which subscribes to all
+        self.visibleColumns = None
+        self.visiblePids = frozenset()
+        self.fullRefreshRequested = True
+
+        # host -> agent.AgentConnection, missing while not connected, and
+        # the subscription last sent on it
+        self.connections = {}
+        self.subscriptions = {}
+
+        # key -> recording.Row of what the model shows
+        self.shown = {}
+
+    @classmethod
+    def key(cls, host, pid):
+        return host << cls.HOST_SHIFT | pid
+
+    @pyqtSlot()
+    def startRefreshTimer(self):
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start(self.refreshInterval)
+        self.refresh()
+
+    def setVisiblePids(self, pids):
+        self.visiblePids = frozenset(pids)
+
+    @pyqtSlot()
+    def requestFullRefresh(self):
+        self.fullRefreshRequested = True
+
+    @pyqtSlot('qint64')
+    def setThreadPid(self, pid):
+        # agents do not serve threads
+        self.threadsRefreshed.emit(pid, [])
+
+    def shutdown(self):
+        for connection in self.connections.values():
+            connection.close()
+        self.connections = {}
+
+    def subscribe(self, host, connection, fullRefresh):
+        columns = self.visibleColumns
+        if columns is None:
+            fields = ALL_FIELDS
+        else:
+            fields = STRUCTURE_FIELDS | field_mask(
+                {self.COLUMN_FIELDS[colIdx] for colIdx in columns if colIdx in self.COLUMN_FIELDS})
+        pids = None
+        if self.visiblePids:
+            pids = {key & self.PID_MASK for key in self.visiblePids
+                    if key >> self.HOST_SHIFT == host and key & self.PID_MASK}
+        subscription = (fields, pids)
+        if fullRefresh or subscription != self.subscriptions.get(host):
+            connection.subscribe(fields, pids, fullRefresh)
+            self.subscriptions[host] = subscription
+
+    def hostNode(self, host, label, newProcNodes, changedNodes):
+        # the host's node is added on the first tick and renamed to show
+        # whether its agent is connected
+        key = self.key(host, 0)
+        row = DEFAULT_ROW._replace(name=label)
+        snapshot = ProcTableModelReplayer.snapshot(0, row)
+        node = self.procTable.get(key)
+        if node is None:
+            node = ProcessNode(key, process=RecordedProcess(0, row), snapshot=snapshot,
+                               columns=self.columns)
+            self.procTable[key] = node
+            newProcNodes.append(node)
+        else:
+            node.applySnapshot(snapshot)
+            changedCols = node.changedColumns()
+            if changedCols:
+                changedNodes.append((node,) + changedCols)
+
+    def removeHost(self, host, removedNodes):
+        for key in [key for key in self.shown if key >> self.HOST_SHIFT == host]:
+            self.removeProcess(key, removedNodes)
+
+    def removeProcess(self, key, removedNodes):
+        del self.shown[key]
+        node = self.procTable.pop(key)
+        self.columns.release(key)
+        self.history.release(key)
+        removedNodes.append(node)
+
+    def applyHost(self, host, state, touched, newProcNodes, removedNodes, changedNodes):
+        # the same as ProcTableModelReplayer.seek for the processes of one
+        # host that changed
+        for pid in touched:
+            key = self.key(host, pid)
+            row = state.get(pid)
+            oldRow = self.shown.get(key)
+            if oldRow is not None and (row is None or row.starttime != oldRow.starttime):
+                self.removeProcess(key, removedNodes)
+                oldRow = None
+            if row is None or row == oldRow:
+                continue
+
+            # the parent is on the same host, pid 0 being the host's node
+            snapshot = ProcTableModelReplayer.snapshot(pid, row._replace(
+                ppid=self.key(host, row.ppid)))
+            self.shown[key] = row
+            if oldRow is None:
+                newNode = ProcessNode(key, process=RecordedProcess(pid, row), snapshot=snapshot,
+                                      columns=self.columns)
+                self.procTable[key] = newNode
+                newProcNodes.append(newNode)
+            else:
+                node = self.procTable[key]
+                node.data.row = row
+                node.applySnapshot(snapshot)
+                changedCols = node.changedColumns()
+                if changedCols:
+                    changedNodes.append((node,) + changedCols)
 
-        self.modelRefresh.emit(newProcNodes)
+    @pyqtSlot()
+    @timed('aggregate.tick')
+    def refresh(self):
+        tickStart = time.perf_counter()
+        fullRefresh = self.fullRefreshRequested
+        self.fullRefreshRequested = False
+        newProcNodes = []
+        removedNodes = []
+        changedNodes = []
+        for host, address in enumerate(self.addresses, 1):
+            connection = self.connections.get(host)
+            if connection is None:
+                # an agent that is not up yet, or went away, is retried
+                # on every tick
+                try:
+                    connection = AgentConnection(address)
+                except (OSError, ValueError):
+                    self.hostNode(host, '{} (not connected)'.format(address),
+                                  newProcNodes, changedNodes)
+                    continue
+                self.connections[host] = connection
+                self.subscriptions.pop(host, None)
+                self.hostNode(host, '{} ({})'.format(connection.hostname, address),
+                              newProcNodes, changedNodes)
+            try:
+                self.subscribe(host, connection, fullRefresh)
+                touched = connection.receive()
+            except (OSError, ValueError):
+                connection.close()
+                del self.connections[host]
+                self.removeHost(host, removedNodes)
+                self.hostNode(host, '{} (not connected)'.format(address),
+                              newProcNodes, changedNodes)
+                continue
+            self.applyHost(host, connection.state, touched, newProcNodes, removedNodes,
+                           changedNodes)
+
+        self.history.record(self.columns, time.time())
+        self.modelRefresh.emit(
+            ProcTableModelRefresher.RefreshDelta(newProcNodes, removedNodes, changedNodes,
+                                                 self.columns.snapshot()))
+        self.tickFinished.emit(time.perf_counter() - tickStart)
 
 
 class ProcTableModel(QAbstractItemModel):
     FindHandleResult = namedtuple('FindHandleResult', ['procName', 'pid', 'type', 'name'])
 
-    def __init__(self, parent=None):
+    # emitted when the model needs every process refreshed on the next
+    # tick rather than only those in view
+    fullRefreshRequested = pyqtSignal()
+
+    def __init__(self, parent=None, live=True):
         super().__init__(parent)
 
         # headers or columns available in the treeview
         self.headers = ['Process Name', 'CPU %', 'Mem %', 'PID',
-                        'RSS', 'User', 'Nice', 'Priority']
+                        'RSS', 'User', 'Nice', 'Priority',
+                        'PSS', 'Swap', 'Shared Clean', 'Shared Dirty',
+                        'Private Clean', 'Private Dirty', 'CPU History', 'RSS History']
+
+        # columns hidden unless the user asks for them. the footprint ones
+        # are read from smaps_rollup which costs more than the stat/status
+        # columns and the history ones are sparklines
+        self.optionalColumns = list(range(8, len(self.headers)))
+        self.footprintColumns = list(range(8, 14))
+        self.historyColumns = sorted(ProcessNode.HISTORY_COLUMNS)
 
         # the model is in a sorted state when the widget
         # has setSortingEnabled() set to true
@@ -139,6 +840,14 @@ class ProcTableModel(QAbstractItemModel):
         # or Qt.DescendingOrder
         self.sortOrder = None
 
+        # sort the children of every process among themselves and keep the
+        # tree, or sort all processes as one flat list
+        self.sortWithinTree = True
+
+        # nodes inserted while sorted, they still have to be moved to
+        # their place by resortRows()
+        self.unsortedNodes = set()
+
         # add a dummy root node. this root node is not shown in the
         # view (only its children) but it is needed by the view to
         # show the hierarchy. also, it simplifies sorting of processes
@@ -149,89 +858,311 @@ class ProcTableModel(QAbstractItemModel):
         # that in will require if pid == 0 checks when processing nodes
         # e.g. when updating all nodes
         self.procTable = {}
-        self.setProcHierarchy(ProcUtil.pids())
+
+        # the numeric columns of every process in procTable
+        self.columns = ProcColumns()
+
+        # the fds and libraries of every process, filled in and kept up
+        # to date by the refresh thread for findHandlesBySubstr
+        self.handleIndex = HandleIndex()
+
+        # recent cpu % and rss of every process, recorded by the refresh
+        # thread on every tick
+        self.history = ProcHistory()
+
+        # a model replaying a recording starts out empty and gets its
+        # processes from ProcTableModelReplayer
+        if live:
+            self.setProcHierarchy(ProcUtil.pids())
 
     def setProcHierarchy(self, pids):
-        logging.debug("setProcHierarchy")
+        sample = ProcUtil.system_sample()
         for pid in pids:
             if pid in self.procTable:
                 node = self.procTable[pid]
             else:
-                node = ProcessNode(pid)
+                node = ProcessNode(pid, sample=sample, columns=self.columns)
                 self.procTable[pid] = node
-            ppid = node.data.parent_pid()
+            ppid = node.ppid
             if ppid not in self.procTable and ppid != 0:
-                self.procTable[ppid] = ProcessNode(ppid)
+                self.procTable[ppid] = ProcessNode(ppid, sample=sample, columns=self.columns)
             if ppid == 0:
                 self.root.insertChild(node)
                 node.parent = self.root
             else:
                 self.procTable[ppid].insertChild(node)
                 node.parent = self.procTable[ppid]
+        self.columns.compute(sample)
+        self.columns.publish(self.columns.snapshot())
 
     def parentModelIndex(self, node):
-        parentNode = node.parent
-        grandParent = parentNode.parent
-        return self.createIndex(grandParent.rowOfChild(parentNode), 0, grandParent)
+        return self.modelIndex(node.parent)
 
     def addNodesToHierarchy(self, newProcNodes):
+        pending = set(newProcNodes)
         for node in newProcNodes:
-            node.parent = self.procTable[node.data.parent_pid()]
-            parentMIdx = self.parentModelIndex(node)
-            insertionRow = self.rowCount(parentMIdx)
-            self.beginInsertRows(parentMIdx, insertionRow , insertionRow)
-            node.parent.insertChild(node)
-            self.endInsertRows()
-
-    def updateNodeProperties(self, root):
-        if root.assignProperties():
-            for childNode in root.children:
-                self.updateNodeProperties(childNode)
+            self.attachNode(node, pending)
+
+    def attachNode(self, node, pending):
+        # new nodes can be the parents of other new nodes so make sure a
+        # node's parent is part of the tree before the node itself
+        if node not in pending:
+            return
+        pending.discard(node)
+        if node.parent is not None:
+            # already placed in the tree, e.g. by sort() or removeSort()
+            return
+        if self.flattened:
+            parentNode = self.root
         else:
-            childIdx = root.parent.rowOfChild(root)
-            self.beginRemoveRows(self.parentModelIndex(root), childIdx, childIdx)
-            root.parent.removeChild(root)
-            self.endRemoveRows()
+            parentNode = self.procTable.get(node.ppid, self.root)
+            self.attachNode(parentNode, pending)
+            if parentNode is not self.root and parentNode.parent is None:
+                # the parent exited before it made it into the tree
+                parentNode = self.root
+        self.insertNode(node, parentNode)
 
-    @pyqtSlot(list)
-    def update(self, newProcNodes):
-        self.layoutAboutToBeChanged.emit()
-        if newProcNodes:
-            self.addNodesToHierarchy(newProcNodes)
+    def insertNode(self, node, parentNode):
+        insertionRow = len(parentNode)
+        self.beginInsertRows(self.modelIndex(parentNode), insertionRow, insertionRow)
+        node.parent = parentNode
+        parentNode.insertChild(node)
+        self.endInsertRows()
+        if self.sorted:
+            self.unsortedNodes.add(node)
+
+    def detachNode(self, node):
+        childIdx = node.parent.rowOfChild(node)
+        self.beginRemoveRows(self.parentModelIndex(node), childIdx, childIdx)
+        node.parent.removeChild(node)
+        node.parent = None
+        self.endRemoveRows()
+
+    @property
+    def flattened(self):
+        return self.sorted and not self.sortWithinTree
+
+    def modelIndex(self, node, col=0):
+        if node is self.root:
+            return QModelIndex()
+        return self.createIndex(node.parent.rowOfChild(node), col, node)
 
-        for child in self.root.children:
-            self.updateNodeProperties(child)
+    def reparentNodes(self):
+        # processes are re-parented when their parent exits (usually to
+        # init or the closest subreaper) so move them under their new
+        # parent before the parent's row goes away
+        for node in list(self.procTable.values()):
+            parentNode = node.parent
+            if parentNode is None or parentNode.pid == node.ppid:
+                continue
+            newParent = self.procTable.get(node.ppid)
+            if newParent is None or newParent.parent is None:
+                if parentNode is self.root:
+                    continue
+                newParent = self.root
+            self.detachNode(node)
+            self.insertNode(node, newParent)
+
+    @pyqtSlot(object)
+    @timed('model.update')
+    def update(self, delta):
+        # the values of this tick, before any row is added that shows them
+        self.columns.publish(delta.columns)
+        if not self.flattened:
+            self.reparentNodes()
+
+        for node in delta.removed:
+            if node.parent is not None and not node.parent.hasChild(node):
+                # dropped by a rebuildHierarchy while the delta was queued
+                node.parent = None
+            if node.parent is not None:
+                # any children left at this point are moved to the root
+                # so they do not disappear along with their parent's row
+                for child in list(node.children):
+                    self.detachNode(child)
+                    self.insertNode(child, self.root)
+                self.detachNode(node)
+
+        if delta.added:
+            self.addNodesToHierarchy(delta.added)
+
+        for node, firstCol, lastCol in delta.changed:
+            node.assignProperties()
 
         if self.sorted:
-            self.root.children.sort(key=lambda node: node.properties[self.sortedColIdx],
-                                    reverse=self.sortOrder == Qt.AscendingOrder)
+            self.resortRows([node for node, firstCol, lastCol in delta.changed])
+
+        for node, firstCol, lastCol in delta.changed:
+            if node.parent is not None:
+                self.dataChanged.emit(self.modelIndex(node, firstCol),
+                                      self.modelIndex(node, lastCol))
+
+    def resortRows(self, changedNodes):
+        # moves the nodes whose sort key changed this tick, and those
+        # inserted since the last call, to their place among their
+        # siblings. the siblings that did not change are still in order, so
+        # each moved node is found its row with a binary search over them
+        # and moved with a single row move. a parent with many moved
+        # children is sorted as a whole instead
+        colIdx = self.sortedColIdx
+        moved = {}
+        for node in changedNodes:
+            key = node.sortKey(colIdx)
+            if key != node.sortKeyCache:
+                node.sortKeyCache = key
+                if node.parent is not None:
+                    moved.setdefault(node.parent, set()).add(node)
+        for node in self.unsortedNodes:
+            node.sortKeyCache = node.sortKey(colIdx)
+            if node.parent is not None:
+                moved.setdefault(node.parent, set()).add(node)
+        self.unsortedNodes = set()
+
+        reverse = self.sortOrder == Qt.AscendingOrder
+        if sum(len(nodes) for nodes in moved.values()) > self.INCREMENTAL_SORT_LIMIT * 8:
+            # one layout change costs the view less than this many moves
+            fullSorts = list(moved)
+        else:
+            fullSorts = {parentNode for parentNode, nodes in moved.items()
+                         if len(nodes) > max(self.INCREMENTAL_SORT_LIMIT, len(parentNode) // 8)}
+            for parentNode, nodes in moved.items():
+                if parentNode not in fullSorts:
+                    self.moveToSortedRows(parentNode, nodes, reverse)
+        if fullSorts:
+            self.changeLayout(lambda: [self.sortChildren(parentNode, reverse)
+                                       for parentNode in fullSorts])
+
+    # a parent with up to this many (or an eighth of its children) moved
+    # children in a tick gets them moved one by one, as long as no more
+    # than 8 times as many move in the whole tree
+    INCREMENTAL_SORT_LIMIT = 32
+
+    def moveToSortedRows(self, parentNode, nodes, reverse):
+        children = parentNode.children
+        inPlace = [child for child in children if child not in nodes]
+        keys = [child.sortKeyCache for child in inPlace]
+        parentMIdx = self.modelIndex(parentNode)
+        for node in sorted(nodes, key=lambda node: node.sortKeyCache, reverse=reverse):
+            # the first of the nodes in place that node goes before
+            key = node.sortKeyCache
+            low, high = 0, len(keys)
+            while low < high:
+                middle = (low + high) // 2
+                if (keys[middle] > key) if reverse else (keys[middle] < key):
+                    low = middle + 1
+                else:
+                    high = middle
+            destination = inPlace[low].row if low < len(inPlace) else len(children)
+            inPlace.insert(low, node)
+            keys.insert(low, key)
+
+            row = node.row
+            if destination in (row, row + 1):
+                continue
+            self.beginMoveRows(parentMIdx, row, row, parentMIdx, destination)
+            del children[row]
+            if destination > row:
+                destination -= 1
+            children.insert(destination, node)
+            parentNode.renumberChildren(min(row, destination), max(row, destination) + 1)
+            self.endMoveRows()
+
+    def sortChildren(self, parentNode, reverse, recursive=False):
+        if not parentNode.children:
+            return
+        colIdx = self.sortedColIdx
+        column = ProcessNode.NUMERIC_COLUMNS.get(colIdx) or ProcessNode.HISTORY_COLUMNS.get(colIdx)
+        if column:
+            # numeric columns are ordered from the column arrays, the keys
+            # are only cached for the incremental moves of resortRows
+            current = self.columns.current
+            children = parentNode.children
+            slots = [child.slot for child in children]
+            keys = zip(map(current[column].__getitem__, slots),
+                       map(current['pid'].__getitem__, slots))
+            for child, key in zip(children, keys):
+                child.sortKeyCache = key
+            bySlot = dict(zip(slots, children))
+            parentNode.children = list(map(bySlot.__getitem__,
+                                           self.columns.sorted_slots(column, slots, reverse)))
+        else:
+            for child in parentNode.children:
+                child.sortKeyCache = child.sortKey(colIdx)
+            parentNode.children.sort(key=lambda node: node.sortKeyCache, reverse=reverse)
+        parentNode.renumberChildren()
+        if recursive:
+            for child in parentNode.children:
+                self.sortChildren(child, reverse, recursive)
+
+    def changeLayout(self, change):
+        # runs change (which reorders or regroups rows) inside a layout
+        # change, keeping the view's persistent indexes (selection, current
+        # row, expanded rows) pointing at the same processes
+        self.layoutAboutToBeChanged.emit()
+        oldIndexes = self.persistentIndexList()
+        persistentNodes = [(self.nodeFromIndex(mIdx), mIdx.column()) for mIdx in oldIndexes]
+        change()
+        self.changePersistentIndexList(
+            oldIndexes, [self.modelIndex(node, col) if node.parent is not None else QModelIndex()
+                         for node, col in persistentNodes])
         self.layoutChanged.emit()
-        self.dataChanged.emit(QModelIndex(), QModelIndex())
+
+    def rebuildHierarchy(self):
+        # puts every node back under its parent process (or the root for
+        # the flat sort) without reading anything from /proc. the refresher
+        # may have taken nodes out of procTable whose removal is still
+        # queued, those are kept as well so the delta can remove their rows
+        nodes = []
+        stack = list(self.root.children)
+        while stack:
+            node = stack.pop()
+            nodes.append(node)
+            stack.extend(node.children)
+        inTree = set(nodes)
+
+        # the refresher adds and removes processes while this runs
+        procTable = dict(self.procTable)
+        nodes.extend(node for node in procTable.values() if node not in inTree)
+        byPid = {node.pid: node for node in nodes}
+        byPid.update(procTable)
+
+        self.root.setChildren([])
+        for node in nodes:
+            node.children = []
+            node.parent = None
+        for node in nodes:
+            parentNode = self.root if self.flattened else byPid.get(node.ppid, self.root)
+            parentNode.insertChild(node)
+            node.parent = parentNode
 
     def removeSort(self):
         self.sorted = False
         self.sortOrder = None
         self.sortedColIdx = -1
-        self.layoutAboutToBeChanged.emit()
-        self.root.children = []
-        self.setProcHierarchy(self.procTable.keys())
-        self.layoutChanged.emit()
+        self.unsortedNodes = set()
+        self.changeLayout(self.rebuildHierarchy)
 
-    def sort(self, columnIdx, order):
-        self.layoutAboutToBeChanged.emit()
-        if not self.sorted:
-            for pid, node in self.procTable.items():
-                node.parent = self.root
-                node.children = []
-                if node not in self.root.children:
-                    self.root.insertChild(node)
-            self.sorted = True
-
-        self.root.children.sort(key=lambda x: x.properties[columnIdx],
-                                reverse=order == Qt.AscendingOrder)
-        self.sortOrder = order
-        self.sortedColIdx = columnIdx
-        self.layoutChanged.emit()
+    def setSortWithinTree(self, withinTree):
+        if withinTree == self.sortWithinTree:
+            return
+        self.sortWithinTree = withinTree
+        if self.sorted:
+            self.sort(self.sortedColIdx, self.sortOrder, rebuild=True)
+
+    def sort(self, columnIdx, order, rebuild=False):
+        # rows outside the view are refreshed less often, have the next
+        # tick bring all of them up to date for the new order
+        self.fullRefreshRequested.emit()
+
+        def change():
+            if rebuild or not self.sorted:
+                self.sorted = True
+                self.rebuildHierarchy()
+            self.sortOrder = order
+            self.sortedColIdx = columnIdx
+            self.unsortedNodes = set()
+            self.sortChildren(self.root, order == Qt.AscendingOrder, recursive=True)
+        self.changeLayout(change)
 
     def getProcDescriptors(self, procMIdx):
         procNode = procMIdx.internalPointer()
@@ -243,47 +1174,78 @@ class ProcTableModel(QAbstractItemModel):
 
     def findHandlesBySubstr(self, substr):
         res = []
-        for pid, procNode in self.procTable.items():
-            try:
-                for desc in procNode.descriptors():
-                    if substr in desc.name:
-                        res.append(
-                            ProcTableModel.FindHandleResult(procNode.properties[0],
-                                                            pid, desc.type, desc.name))
-                for libName in procNode.mappedLibraries():
-                    if substr in libName:
-                        res.append(
-                            ProcTableModel.FindHandleResult(procNode.properties[0],
-                                                            pid, 'Shared Library', libName))
-            except (PermissionError, FileNotFoundError):
-                pass
+        for batch, scanned, total in self.iterHandlesBySubstr(substr):
+            res.extend(batch)
+        return res
+
+    def iterHandlesBySubstr(self, substr, batchSize=256):
+        # yields (results, processes scanned, total processes) as the search
+        # progresses, at most batchSize results at a time. processes already
+        # in the handle index are answered from it, the rest (e.g. before
+        # the first refresh tick has indexed them) are scanned one by one
+        procTable = dict(self.procTable)
+        indexed = self.handleIndex.indexed_pids() & procTable.keys()
+        scanned = len(indexed)
+        batch = []
+        for handle in self.handleIndex.search(substr):
+            if handle.pid in indexed:
+                batch.append(ProcTableModel.FindHandleResult(
+                    procTable[handle.pid].properties[0], handle.pid, handle.type, handle.name))
+                if len(batch) >= batchSize:
+                    yield batch, scanned, len(procTable)
+                    batch = []
+        yield batch, scanned, len(procTable)
+
+        batch = []
+        for pid, procNode in procTable.items():
+            if pid in indexed:
+                continue
+            batch.extend(self.scanProcessHandles(procNode, substr))
+            scanned += 1
+            if len(batch) >= batchSize or scanned % 64 == 0:
+                yield batch, scanned, len(procTable)
+                batch = []
+        yield batch, scanned, len(procTable)
+
+    def scanProcessHandles(self, procNode, substr):
+        res = []
+        try:
+            for desc in procNode.descriptors():
+                if substr in desc.name:
+                    res.append(ProcTableModel.FindHandleResult(procNode.properties[0],
+                                                               procNode.pid, desc.type, desc.name))
+            for libName in procNode.mappedLibraries():
+                if substr in libName:
+                    res.append(ProcTableModel.FindHandleResult(procNode.properties[0],
+                                                               procNode.pid, 'Shared Library', libName))
+        except (PermissionError, FileNotFoundError, ProcessLookupError):
+            pass
         return res
 
+    @timed('model.index')
     def index(self, row, col, parentMIdx):
-        logging.debug("index({}, {}, parentMIdx={})".format(row, col, self.nodeFromIndex(parentMIdx).pid))
         node = self.nodeFromIndex(parentMIdx)
         return self.createIndex(row, col, node.childAtRow(row))
 
+    @timed('model.parent')
     def parent(self, childMIdx):
-        logging.debug("parent(childMIdx={})".format(self.nodeFromIndex(childMIdx).pid))
+        # top level rows have the hidden root, i.e. no parent index
         childNode = self.nodeFromIndex(childMIdx)
-        parent = childNode.parent
-        if not parent:
+        if childNode.parent is None:
             return QModelIndex()
-        row = parent.rowOfChild(childNode)
-        return self.createIndex(row, 0, parent)
+        return self.parentModelIndex(childNode)
 
+    @timed('model.rowCount')
     def rowCount(self, parentMIdx):
-        logging.debug("rowCount(parentMIdx={})".format(self.nodeFromIndex(parentMIdx).pid))
         return len(self.nodeFromIndex(parentMIdx))
 
+    @timed('model.columnCount')
     def columnCount(self, parentMIdx):
-        logging.debug("columnCount(parentMIdx={})".format(self.nodeFromIndex(parentMIdx).pid))
         return len(self.headers)
 
+    @timed('model.data')
     def data(self, mIdx, role=Qt.DisplayRole):
         if role == Qt.DisplayRole:
-            logging.debug("data(mIdx={})".format(self.nodeFromIndex(mIdx).pid))
             node = self.nodeFromIndex(mIdx)
             # show nothing for properties that are '0'
             return node.fields(mIdx.column()) or ""
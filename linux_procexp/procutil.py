@@ -2,9 +2,11 @@ import os
 import os.path
 import re
 import pwd
-import linecache
+import time
+import threading
 from collections import namedtuple
 from enum import Enum
+from .instrumentation import timed
 
 class ProcessState(Enum):
     ZOMBIE = 'Z'
@@ -22,7 +24,9 @@ class ProcInfoFileName:
     CWD = 'cwd'
     MEM_MAP = 'maps'
     STAT = 'stat'
+    SCHEDSTAT = 'schedstat'
     STATUS = 'status'
+    SMAPS_ROLLUP = 'smaps_rollup'
 
 class Process(object):
     PROC_PATH = '/proc'
@@ -32,6 +36,16 @@ class Process(object):
     MappedRegion = namedtuple('MappedRegion', ['start', 'end', 'permissions',
                                                 'offset', 'dev', 'inode', 'name'])
     VirtualMemory = namedtuple('VirtualMemory', ['vsize', 'rss'])
+    # memory attribution from smaps_rollup, all in bytes
+    Footprint = namedtuple('Footprint', ['pss', 'swap', 'shared_clean', 'shared_dirty',
+                                         'private_clean', 'private_dirty'])
+    FOOTPRINT_KEYS = ('Pss:', 'Swap:', 'Shared_Clean:', 'Shared_Dirty:',
+                      'Private_Clean:', 'Private_Dirty:')
+    # everything the process table shows for a process, gathered from a
+    # single read of stat and status. vsize and rss are in bytes
+    Snapshot = namedtuple('Snapshot', ['pid', 'ppid', 'name', 'state', 'starttime',
+                                       'proc_work', 'cpu', 'mem', 'vsize', 'rss',
+                                       'uid', 'owner', 'nice', 'priority', 'threads'])
 
     def __init__(self, pid, parent=None):
         # initializer takes pid as an int since it's more intuitive for the class
@@ -55,22 +69,56 @@ class Process(object):
         self._last_total_work = 0
         self._last_proc_work = 0
 
+        # the start time (stat field 22) of the process this object was
+        # first read as. together with the pid it identifies the process,
+        # a pid that is reused comes back with another start time
+        self._starttime = None
+
         # all the instance variables defined from here are computed only when needed
         # because either the information is not included in the default view or they
-        # are likely to change during the process' execution
-        self._cmdline = ''
+        # are likely to change during the process' execution. they are read once
+        # per program the process runs and forgotten by forget_static() on exec
+        self._cmdline = None
         self._name = ''
+        self._exe = None
+        self._comm = ''
 
     def get_full_path(self, dir_name):
         return os.path.join(self.pid_dir, dir_name)
 
     def get_stat_info(self, prop_idx):
+        return self.read_stat()[prop_idx]
+
+    @timed('proc.stat')
+    def read_stat(self):
         with open(self.get_full_path(ProcInfoFileName.STAT)) as f:
-            return f.read().split()[prop_idx]
+            return ProcUtil.parse_stat(f.read())
+
+    @timed('proc.status')
+    def read_status(self):
+        with open(self.get_full_path(ProcInfoFileName.STATUS)) as f:
+            return ProcUtil.parse_status(f.read())
 
     def pid(self):
         return int(self._pid)
 
+    def identity(self):
+        if self._starttime is None:
+            self._starttime = int(self.get_stat_info(21))
+        return self.pid(), self._starttime
+
+    def forget_static(self):
+        # called when the process exec'd: its exe, cmdline and name belong
+        # to the program it ran before
+        self._cmdline = None
+        self._name = ''
+        self._exe = None
+
+    def exe(self):
+        if self._exe is None:
+            self._exe = os.readlink(os.path.join(self.pid_dir, ProcInfoFileName.EXE))
+        return self._exe
+
     def name(self):
         # TODO: decide what to do with kernel support. for example, this is only
         # valid for kernel >= 2.2
@@ -78,38 +126,37 @@ class Process(object):
             return self._name
 
         try:
-            proc_name = os.path.basename(os.readlink(os.path.join(
-                self.pid_dir, ProcInfoFileName.EXE)))
-        except PermissionError:
+            proc_name = os.path.basename(self.exe())
+        except (PermissionError, FileNotFoundError):
             # most of the time exe has more stringent permissions so
-            # grab the name from the cmdline instead
+            # grab the name from the cmdline instead. kernel threads
+            # do not have an exe link at all. if the process is gone,
+            # reading cmdline will raise FileNotFoundError again
             cmdline = self.cmdline()
             if cmdline:
                 proc_name = cmdline[0]
                 if os.path.exists(proc_name):
                     proc_name = os.path.basename(proc_name)
             else:
-                proc_name = self.get_stat_info(1).strip("()")
+                proc_name = self._comm or self.get_stat_info(1)
 
         self._name = proc_name
         return proc_name
 
     def virtual_memory(self):
-        status_file_path = os.path.join(self.pid_dir, ProcInfoFileName.STATUS)
-        linecache.checkcache(status_file_path)
-        vmsize = linecache.getline(status_file_path, 13).split()
-        # some processes (kthreadd lineage) do not have rss/vmsize in these lines
-        # so return 0 for them
-        if vmsize[0].lower() == 'vmsize:':
-            vmsize = int(vmsize[1]) * 1024
-            rss = int(linecache.getline(status_file_path, 17).split()[1]) * 1024
-        else:
-            vmsize = 0
-            rss = 0
+        return Process.status_memory(self.read_status())
+
+    @staticmethod
+    def status_memory(status):
+        # some processes (kthreadd lineage) do not have rss/vmsize in
+        # their status file so return 0 for them
+        vmsize = int(status.get('VmSize', '0 kB').split()[0]) * 1024
+        rss = int(status.get('VmRSS', '0 kB').split()[0]) * 1024
         return Process.VirtualMemory(vmsize, rss)
 
-    def memory_percent(self):
-        return self.virtual_memory().rss / ProcUtil.memory_info().total * 100
+    def memory_percent(self, sample=None):
+        sample = sample or ProcUtil.system_sample()
+        return self.virtual_memory().rss / sample.mem_total * 100
 
     def priority(self):
         return int(self.get_stat_info(17))
@@ -123,64 +170,92 @@ class Process(object):
         return int(self._parent)
 
     def owner(self):
-        with open(self.get_full_path(ProcInfoFileName.STATUS)) as f:
-            for count, line_info in enumerate(f):
-                if count == 7:
-                    # use the real uid
-                    ruid = line_info.split()[1]
-                    break
-        return Process.Owner(ruid, pwd.getpwuid(int(ruid)).pw_name)
-
-    def cpu_percent(self):
-        with open(os.path.join(self.PROC_PATH, ProcInfoFileName.STAT)) as f:
-            # add the aggregated (all cpus) jiffies stored in the first line
-            total_work = sum(int(val) for val in f.readline().split()[1:])
-
-        with open(self.pid_dir + '/stat') as f:
-            props = f.read().split()
-
-        proc_work = int(props[13]) + int(props[14])
-
+        # use the real uid
+        ruid = self.read_status()['Uid'].split()[0]
+        return Process.Owner(ruid, ProcUtil.user_name(int(ruid)))
+
+    def cpu_percent(self, sample=None):
+        # for one-off callers. the process table leaves cpu % to
+        # ProcColumns.compute, which works it out for all processes at once
+        sample = sample or ProcUtil.system_sample()
+        stat = self.read_stat()
+        return self._cpu_percent(int(stat[13]) + int(stat[14]), sample)
+
+    def _cpu_percent(self, proc_work, sample):
+        # the total work delta is taken against the sample this process was
+        # last measured with
         try:
             cpu_percent = (proc_work - self._last_proc_work) / \
-                          (total_work - self._last_total_work) * 100
+                          (sample.total_work - self._last_total_work) * 100
         except ZeroDivisionError:
             cpu_percent = 0
 
-        self._last_total_work = total_work
+        self._last_total_work = sample.total_work
         self._last_proc_work = proc_work
         return cpu_percent
 
     def state(self):
         return ProcessState(self.get_stat_info(2))
 
+    @timed('proc.maps')
     def memory_maps(self, resolvedev=True):
+        return list(self.iter_memory_maps(resolvedev))
+
+    def iter_memory_maps(self, resolvedev=True, permissions='', name=None):
+        # yields the MappedRegions of the process as the maps file is read
+        # so processes with tens of thousands of mappings never have all of
+        # them in memory at once. only regions having all of the permission
+        # flags in permissions (e.g. 'x' or 'rw') and, if name is given,
+        # whose name contains it are yielded
         with open(self.get_full_path(ProcInfoFileName.MEM_MAP)) as f:
-            maps = []
+            # the device table is looked up once per call, not per line
+            dev_names = ProcUtil.device_resolver.table() if resolvedev else None
             for line in f:
-                map_toks = line.split()
-                start, end = map_toks[0].split('-')
-                if resolvedev:
-                    major, minor = map_toks[3].split(':')
-                    try:
-                        # TODO major minor here do not correspond to /proc/partitions
-                        dev_name = ProcUtil.dev_name(int(major), int(minor))
-                    except DeviceNameNotFound:
-                        dev_name = ''
-                else:
-                    dev_name = map_toks[3]
+                # the name is the only field that can contain spaces
+                map_toks = line.rstrip('\n').split(None, 5)
 
                 # anonymous memory maps will not have a name
                 if len(map_toks) < 6:
                     map_toks.append('')
+                if name is not None and name not in map_toks[5]:
+                    continue
+                if permissions and not all(flag in map_toks[1] for flag in permissions):
+                    continue
+
+                start, end = map_toks[0].split('-')
+                dev_name = dev_names.get(map_toks[3], '') if resolvedev else map_toks[3]
+                yield Process.MappedRegion(start, end, map_toks[1], map_toks[2],
+                                           dev_name, map_toks[4], map_toks[5])
+
+    @timed('proc.smaps_rollup')
+    def memory_footprint(self):
+        # smaps_rollup (linux >= 4.14) has the totals of smaps without the
+        # per mapping detail, so its cost does not grow with the number of
+        # mappings read from python
+        values = {}
+        with open(self.get_full_path(ProcInfoFileName.SMAPS_ROLLUP)) as f:
+            # the first line is the address range header
+            next(f)
+            for line in f:
+                fields = line.split()
+                if len(fields) == 3:
+                    values[fields[0]] = int(fields[1]) * 1024
+        return Process.Footprint(*(values.get(key, 0) for key in Process.FOOTPRINT_KEYS))
 
-                maps.append(Process.MappedRegion(start, end, map_toks[1], map_toks[2],
-                                                 dev_name, map_toks[4], map_toks[5]))
-        return maps
+    def libraries(self):
+        # the start time tells a recycled pid apart and the virtual size
+        # changes with every mmap/munmap, so together they decide whether
+        # the cached libraries are still valid without parsing maps
+        stat = self.read_stat()
+        return ProcUtil.library_cache.libraries(self, (int(stat[21]), int(stat[22])))
+
+    def read_libraries(self):
+        return {region.name for region in self.iter_memory_maps(resolvedev=False, name='.so')}
 
     def cwd(self):
         return os.readlink(self.get_full_path(ProcInfoFileName.CWD))
 
+    @timed('proc.fd')
     def descriptors(self, fspathonly=False):
         fd_dir = self.get_full_path(ProcInfoFileName.FD)
         descriptor_list = []
@@ -207,7 +282,7 @@ class Process(object):
             self.pid_dir, ProcInfoFileName.THREADS))]
 
     def cmdline(self):
-        if not self._cmdline:
+        if self._cmdline is None:
             with open(self.get_full_path(ProcInfoFileName.CMDLINE)) as f:
                 line = f.read().rstrip('\0')
                 if line.count('\0') == 0:
@@ -219,53 +294,306 @@ class Process(object):
 
         return self._cmdline
 
-    def get_props(self):
+    @timed('proc.raw')
+    def read_raw(self):
+        # the unparsed contents of stat and status, for callers that want
+        # to do the parsing elsewhere (see collector.ProcCollector)
+        with open(self.get_full_path(ProcInfoFileName.STAT)) as f:
+            stat = f.read()
+        with open(self.get_full_path(ProcInfoFileName.STATUS)) as f:
+            status = f.read()
+        return stat, status
+
+    @timed('proc.snapshot')
+    def snapshot(self, sample=None, stat=None, status=None):
+        # stat and status are each opened exactly once here, every column
+        # of the process table is derived from these two reads. the system
+        # wide values come from sample, which callers refreshing many
+        # processes should capture once and share between them. already
+        # parsed stat and status can be passed in instead of being read
+        sample = sample or ProcUtil.system_sample()
+        if stat is None:
+            stat = self.read_stat()
+        if status is None:
+            status = self.read_status()
+
+        starttime = int(stat[21])
+        if self._starttime is None:
+            self._starttime = starttime
+        elif starttime != self._starttime:
+            # the pid now belongs to another process, nothing remembered
+            # about the old one applies
+            self._starttime = starttime
+            self._last_total_work = 0
+            self._last_proc_work = 0
+            self._comm = ''
+            self.forget_static()
+        if self._comm and stat[1] != self._comm:
+            # exec sets comm to the new program's name
+            self.forget_static()
+
+        # cpu % is left to ProcColumns.compute, from proc_work
+        proc_work = int(stat[13]) + int(stat[14])
+
+        vsize, rss = Process.status_memory(status)
+        mem = rss / sample.mem_total * 100
+
+        # use the real uid
+        uid = int(status['Uid'].split()[0])
+
+        # the comm field from stat saves name() from another read of
+        # stat when exe and cmdline cannot be used
+        self._comm = stat[1]
+        return Process.Snapshot(self.pid(), int(stat[3]), self.name(), stat[2],
+                                starttime, proc_work, None, mem, vsize, rss, uid,
+                                ProcUtil.user_name(uid), int(stat[18]),
+                                int(stat[17]), int(stat[19]))
+
+    def get_props(self, sample=None):
         Props = namedtuple('Props', ['pid', 'name', 'cpu', 'mem', 'rss', 'nice', 'priority', 'owner'])
-        with open(self.pid_dir + '/stat') as f:
-            stats = f.readline().split()
-            nice = int(stats[18])
-            priority = int(stats[17])
-
-        status_file = self.pid_dir + '/status'
-        linecache.checkcache(status_file)
-        ruid = int(linecache.getline(status_file, 8).split()[1])
-        user = pwd.getpwuid(ruid).pw_name
-        rss_line = linecache.getline(status_file, 17).split()
-        rss = int(rss_line[1]) if rss_line[0].lower() == 'vmrss:' else 0
-        mem = rss / ProcUtil.memory_info().total * 100
-        return Props(self._pid, self.name(), round(self.cpu_percent(), 2),
-                     round(mem, 2), rss / 1048576, nice, priority, user)
+        sample = sample or ProcUtil.system_sample()
+        snap = self.snapshot(sample)
+        cpu = self._cpu_percent(snap.proc_work, sample)
+        return Props(self._pid, snap.name, round(cpu, 2), round(snap.mem, 2),
+                     snap.rss / 1048576, snap.nice, snap.priority, snap.owner)
 
 
 class DeviceNameNotFound(Exception):
     pass
 
+class LibraryCache(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        # pid -> (key, libraries) where key is (starttime, vsize)
+        self._entries = {}
+
+        # library paths and whole library sets repeat across processes
+        # (every bash has the same ones) so both are interned here and
+        # shared by all the entries using them. sets are reference counted
+        # so those of exited processes can be dropped
+        self._names = {}
+        self._sets = {}
+        self._set_refs = {}
+
+    def libraries(self, proc, key):
+        pid = proc.pid()
+        entry = self._entries.get(pid)
+        if entry is not None and entry[0] == key:
+            return entry[1]
+
+        names = self._names
+        libraries = frozenset(names.setdefault(name, name) for name in proc.read_libraries())
+        with self._lock:
+            libraries = self._sets.setdefault(libraries, libraries)
+            self._set_refs[libraries] = self._set_refs.get(libraries, 0) + 1
+            self._release(self._entries.get(pid))
+            self._entries[pid] = (key, libraries)
+        return libraries
+
+    def _release(self, entry):
+        if entry is None:
+            return
+        libraries = entry[1]
+        self._set_refs[libraries] -= 1
+        if not self._set_refs[libraries]:
+            del self._set_refs[libraries]
+            del self._sets[libraries]
+
+    def discard(self, pid):
+        with self._lock:
+            self._release(self._entries.pop(pid, None))
+
+class DeviceResolver(object):
+    SYS_PATH = '/sys'
+
+    # minimum number of seconds between checks for a changed partition
+    # table, as with UidResolver.CHECK_INTERVAL
+    CHECK_INTERVAL = 1
+
+    def __init__(self):
+        self._table = {}
+        self._signature = None
+        self._last_check = None
+
+    def table(self):
+        # returns a dict of major:minor -> device name. the keys are in the
+        # form used by the maps file (hex, at least 2 digits, e.g. 'fd:01')
+        # so a maps line can be resolved with a single dict lookup
+        now = time.monotonic()
+        if self._last_check is None or now - self._last_check >= self.CHECK_INTERVAL:
+            self._last_check = now
+            signature = self._read_signature()
+            if signature != self._signature:
+                self._signature = signature
+                self._table = self._build(signature[0])
+        return self._table
+
+    def _read_signature(self):
+        # the partition table and the set of block devices in sysfs change
+        # when disks, partitions, device-mapper or loop devices come and go
+        try:
+            with open(os.path.join(Process.PROC_PATH, 'partitions')) as f:
+                partitions = f.read()
+        except OSError:
+            partitions = ''
+        try:
+            block_devs = frozenset(os.listdir(os.path.join(self.SYS_PATH, 'dev', 'block')))
+        except OSError:
+            block_devs = frozenset()
+        return partitions, block_devs
+
+    @staticmethod
+    def _key(major, minor):
+        return '{:02x}:{:02x}'.format(int(major), int(minor))
+
+    def _build(self, partitions):
+        table = {}
+
+        # devices without a block device behind them (overlay, tmpfs,
+        # btrfs subvolumes...) get an anonymous major 0 device number.
+        # name those after the filesystem mounted on them
+        try:
+            with open(os.path.join(Process.PROC_PATH, 'self', 'mountinfo')) as f:
+                for line in f:
+                    fields = line.split()
+                    major, minor = fields[2].split(':')
+                    fs_type = fields[fields.index('-') + 1]
+                    table.setdefault(self._key(major, minor), fs_type)
+        except OSError:
+            pass
+
+        # first line are headers, second line is a blank line
+        for dev_entry in partitions.splitlines()[2:]:
+            fields = dev_entry.split()
+            if len(fields) == 4:
+                table[self._key(fields[0], fields[1])] = fields[3]
+
+        # sysfs also has the devices missing from /proc/partitions and
+        # knows the names of device-mapper devices (e.g. vg-root for dm-0)
+        block_dir = os.path.join(self.SYS_PATH, 'dev', 'block')
+        try:
+            block_devs = os.listdir(block_dir)
+        except OSError:
+            block_devs = []
+        for dev in block_devs:
+            major, minor = dev.split(':')
+            dev_dir = os.path.join(block_dir, dev)
+            try:
+                with open(os.path.join(dev_dir, 'dm', 'name')) as f:
+                    name = f.read().strip()
+            except OSError:
+                try:
+                    name = os.path.basename(os.readlink(dev_dir))
+                except OSError:
+                    continue
+            table[self._key(major, minor)] = name
+        return table
+
+class UidResolver(object):
+    # changes to any of these files can change the uid -> name mapping
+    WATCHED_FILES = ('/etc/passwd', '/etc/nsswitch.conf')
+
+    # minimum number of seconds between checks of the watched files so a
+    # refresh tick stats them once rather than once per process
+    CHECK_INTERVAL = 1
+
+    def __init__(self):
+        self._names = {}
+        self._mtimes = self._watched_mtimes()
+        self._last_check = time.monotonic()
+
+    def _watched_mtimes(self):
+        mtimes = []
+        for path in self.WATCHED_FILES:
+            try:
+                mtimes.append(os.stat(path).st_mtime)
+            except OSError:
+                mtimes.append(None)
+        return mtimes
+
+    def _check_watched_files(self):
+        now = time.monotonic()
+        if now - self._last_check < self.CHECK_INTERVAL:
+            return
+        self._last_check = now
+        mtimes = self._watched_mtimes()
+        if mtimes != self._mtimes:
+            self._mtimes = mtimes
+            self._names = {}
+
+    def name(self, uid):
+        self._check_watched_files()
+        try:
+            return self._names[uid]
+        except KeyError:
+            pass
+
+        # getpwuid can be slow with NSS backends such as LDAP so misses are
+        # cached as well. uids without a passwd entry show up as the number
+        try:
+            name = pwd.getpwuid(uid).pw_name
+        except KeyError:
+            name = str(uid)
+        self._names[uid] = name
+        return name
+
 class ProcUtil(object):
     MemInfo = namedtuple('MemInfo', ['total', 'free', 'available', 'buffers', 'cached',
                                      'swapcached', 'active', 'inactive'])
+    # system wide values shared by every process measured in the same tick.
+    # total_work is the aggregated jiffies of all cpus and mem_total is in
+    # bytes. cpu % takes the total work elapsed for each process against
+    # the sample it was last measured with, see ProcColumns.compute
+    SystemSample = namedtuple('SystemSample', ['total_work', 'mem_total', 'mem_info'])
+
+    _uid_resolver = UidResolver()
+    library_cache = LibraryCache()
+    device_resolver = DeviceResolver()
 
     @staticmethod
+    def set_proc_path(path):
+        # every /proc read goes through Process.PROC_PATH, pointing it
+        # somewhere else allows reading a copy or a synthetic proc tree
+        Process.PROC_PATH = path
+
+    @staticmethod
+    def user_name(uid):
+        return ProcUtil._uid_resolver.name(uid)
+
+    @staticmethod
+    @timed('proc.pids')
     def pids():
-        return [int(entry) for entry in os.listdir('/proc') if re.match('\d+', entry)]
+        return [int(entry) for entry in os.listdir(Process.PROC_PATH) if re.match('\d+', entry)]
 
     @staticmethod
-    def dev_name(major, minor):
-        with open('/proc/partitions') as f:
-            part_table = {}
-            # first line are headers, second line is a blank line
-            next(f); next(f)
-            for dev_entry in f:
-                fields = dev_entry.split()
-            part_table[(fields[0], fields[1])] = fields[3]
+    def parse_stat(stat_line):
+        # the process name (field 2) is wrapped in parentheses and may itself
+        # contain spaces or parentheses, so split around the last ')'. the
+        # returned list keeps the field numbering of proc(5), minus one
+        head, _, tail = stat_line.rpartition(')')
+        pid, comm = head.split('(', 1)
+        return [pid.strip(), comm] + tail.split()
 
+    @staticmethod
+    def parse_status(status_text):
+        # status lines are 'Key:\tvalue', look values up by key rather than
+        # by line number since the layout differs between kernel versions
+        status = {}
+        for line in status_text.splitlines():
+            key, _, value = line.partition(':')
+            status[key] = value.strip()
+        return status
+
+    @staticmethod
+    def dev_name(major, minor):
         try:
-            return part_table[(major, minor)]
+            return ProcUtil.device_resolver.table()['{:02x}:{:02x}'.format(major, minor)]
         except KeyError:
             raise DeviceNameNotFound('No device name mapping for {}:{}'.format(major, minor))
 
     @staticmethod
     def memory_info():
-        with open('/proc/meminfo') as f:
+        with open(os.path.join(Process.PROC_PATH, 'meminfo')) as f:
             mem_data = []
             for i, entry in enumerate(f):
                 # by default mem info is in KB, return everything in bytes
@@ -274,3 +602,13 @@ class ProcUtil(object):
                 if i == 7:
                     break
         return ProcUtil.MemInfo(*mem_data)
+
+    @staticmethod
+    @timed('proc.system_sample')
+    def system_sample():
+        with open(os.path.join(Process.PROC_PATH, ProcInfoFileName.STAT)) as f:
+            # add the aggregated (all cpus) jiffies stored in the first line
+            total_work = sum(int(val) for val in f.readline().split()[1:])
+
+        mem_info = ProcUtil.memory_info()
+        return ProcUtil.SystemSample(total_work, mem_info.total, mem_info)
@@ -0,0 +1,377 @@
+import mmap
+import os
+import struct
+import zlib
+from array import array
+from collections import namedtuple
+from .instrumentation import timed
+
+# a recording is two append-only files. the data file starts with MAGIC
+# and then holds one record per tick: a _RECORD header (kind, length)
+# followed by a zlib compressed payload. a KEYFRAME payload is the whole
+# process table, a DELTA payload only what changed since the previous
+# tick. the index file (data file + INDEX_SUFFIX) has one fixed size
+# _INDEX entry per tick: its timestamp, the offset of its record and the
+# offset of the keyframe it builds on, so any tick is found with one
+# lookup and rebuilt from at most KEYFRAME_INTERVAL records
+MAGIC = b'LPXREC\x00\x01'
+INDEX_SUFFIX = '.idx'
+KEYFRAME = 1
+DELTA = 2
+
+_RECORD = struct.Struct('<BI')
+_INDEX = struct.Struct('<dQQ')
+_TICK = struct.Struct('<dIII')
+# pid, ppid, starttime, cpu, mem, rss, vsize, nice, priority. cpu and mem
+# are stored in hundredths of a percent, the precision they are shown in
+_PROCESS = struct.Struct('<iiQiiqqii')
+_CHANGE = struct.Struct('<iH')
+_STRING = struct.Struct('<H')
+
+# what is recorded of a process, apart from its pid
+Row = namedtuple('Row', ['starttime', 'ppid', 'name', 'owner', 'cpu', 'mem', 'rss', 'vsize',
+                         'nice', 'priority'])
+
+# the fields a delta entry can carry, in the order of its mask bits. the
+# starttime never changes, a process with a new one is a new process
+_FIELDS = [(Row._fields.index(name), code) for name, code in
+           (('ppid', 'i'), ('name', 's'), ('owner', 's'), ('cpu', 'i'), ('mem', 'i'),
+            ('rss', 'q'), ('vsize', 'q'), ('nice', 'i'), ('priority', 'i'))]
+_FIELD_STRUCTS = {code: struct.Struct('<' + code) for code in 'iq'}
+_PERCENT_FIELDS = (Row._fields.index('cpu'), Row._fields.index('mem'))
+_FIELD_BITS = {field: 1 << bit for bit, (field, _) in enumerate(_FIELDS)}
+_STRING_BITS = sum(1 << bit for bit, (_, code) in enumerate(_FIELDS) if code == 's')
+# delta masks seen so far -> what _number_fields returned for them
+_NUMBER_MASKS = {}
+
+
+def _pack_string(value):
+    data = value.encode()[:0xffff]
+    return _STRING.pack(len(data)) + data
+
+
+def _unpack_string(payload, offset):
+    length, = _STRING.unpack_from(payload, offset)
+    offset += _STRING.size
+    return payload[offset:offset + length].decode(errors='replace'), offset + length
+
+
+def _percent(value):
+    return int(round(value * 100))
+
+
+def _scan(data, offset, end):
+    # yields (kind, offset) for every complete record from offset on. a
+    # record cut short by a crash ends the scan
+    while offset + _RECORD.size <= end:
+        kind, length = _RECORD.unpack_from(data, offset)
+        if offset + _RECORD.size + length > end:
+            return
+        yield kind, offset
+        offset += _RECORD.size + length
+
+
+def _decode(data, offset, state):
+    # applies the record at offset to state (pid -> Row) and returns the
+    # tick's timestamp
+    kind, length = _RECORD.unpack_from(data, offset)
+    start = offset + _RECORD.size
+    payload = zlib.decompress(data[start:start + length])
+    timestamp, removed, added, changed = _TICK.unpack_from(payload, 0)
+    offset = _TICK.size
+
+    if kind == KEYFRAME:
+        state.clear()
+    pids = array('i')
+    pids.frombytes(payload[offset:offset + removed * pids.itemsize])
+    offset += removed * pids.itemsize
+    for pid in pids:
+        state.pop(pid, None)
+
+    for _ in range(added):
+        pid, ppid, starttime, cpu, mem, rss, vsize, nice, priority = \
+            _PROCESS.unpack_from(payload, offset)
+        name, offset = _unpack_string(payload, offset + _PROCESS.size)
+        owner, offset = _unpack_string(payload, offset)
+        state[pid] = Row(starttime, ppid, name, owner, cpu / 100, mem / 100, rss, vsize,
+                         nice, priority)
+
+    for _ in range(changed):
+        pid, mask = _CHANGE.unpack_from(payload, offset)
+        offset += _CHANGE.size
+        values = list(state[pid])
+        numbers = _NUMBER_MASKS.get(mask)
+        if numbers is None and not mask & _STRING_BITS:
+            numbers = _NUMBER_MASKS[mask] = _number_fields(mask)
+        if numbers is not None:
+            # only numbers changed, which is most of the time, so they are
+            # unpacked in one go
+            fields, unpacker = numbers
+            for field, value in zip(fields, unpacker.unpack_from(payload, offset)):
+                values[field] = value
+            offset += unpacker.size
+        else:
+            for bit, (field, code) in enumerate(_FIELDS):
+                if mask & (1 << bit):
+                    if code == 's':
+                        values[field], offset = _unpack_string(payload, offset)
+                    else:
+                        values[field], = _FIELD_STRUCTS[code].unpack_from(payload, offset)
+                        offset += _FIELD_STRUCTS[code].size
+        for field in _PERCENT_FIELDS:
+            if mask & _FIELD_BITS[field]:
+                values[field] /= 100
+        state[pid] = Row._make(values)
+    return timestamp
+
+
+def _number_fields(mask):
+    # the Row fields set by a mask without strings and a Struct unpacking
+    # all of their values
+    fields = [(field, code) for bit, (field, code) in enumerate(_FIELDS) if mask & (1 << bit)]
+    return ([field for field, _ in fields],
+            struct.Struct('<' + ''.join(code for _, code in fields)))
+
+
+def _record_end(data, offset, size):
+    # where the record at offset ends, or None if it does not fit in size
+    if offset + _RECORD.size > size:
+        return None
+    end = offset + _RECORD.size + _RECORD.unpack_from(data, offset)[1]
+    return end if end <= size else None
+
+
+def _index_entries(data, size, entries):
+    # returns the index entries that point at complete records, followed
+    # by entries for the complete records after them that the index does
+    # not cover yet (a crash between writing a record and its entry, or a
+    # deleted index), and where the last complete record ends
+    count = len(entries) // _INDEX.size
+    start, keyframe = len(MAGIC), 0
+    while count:
+        _, offset, last_keyframe = _INDEX.unpack_from(entries, (count - 1) * _INDEX.size)
+        end = _record_end(data, offset, size)
+        if end is not None:
+            start, keyframe = end, last_keyframe
+            break
+        count -= 1
+
+    missing = []
+    for kind, offset in _scan(data, start, size):
+        if kind == KEYFRAME:
+            keyframe = offset
+        start = _record_end(data, offset, size)
+        payload = zlib.decompress(data[offset + _RECORD.size:start])
+        missing.append(_INDEX.pack(_TICK.unpack_from(payload, 0)[0], offset, keyframe))
+    return entries[:count * _INDEX.size] + b''.join(missing), start
+
+
+def _check_magic(f, path):
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError('{} is not a process recording'.format(path))
+
+
+def _read_index(path):
+    try:
+        with open(path + INDEX_SUFFIX, 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        return b''
+
+
+class SnapshotRecorder(object):
+    # appends a record per tick to path. a keyframe is written every
+    # keyframe_interval ticks and at the start of every recording session,
+    # the ticks in between are deltas against the previous one
+    KEYFRAME_INTERVAL = 50
+
+    def __init__(self, path, keyframe_interval=KEYFRAME_INTERVAL):
+        self.path = path
+        self.keyframe_interval = keyframe_interval
+        if not os.path.exists(path) or not os.path.getsize(path):
+            with open(path, 'wb') as f:
+                f.write(MAGIC)
+            open(path + INDEX_SUFFIX, 'wb').close()
+        self._keyframe = self._repair(path)
+        self._data = open(path, 'ab')
+        self._index = open(path + INDEX_SUFFIX, 'ab')
+
+        # pid -> Row as of the last recorded tick
+        self.state = {}
+        self._ticks_since_keyframe = None
+
+    @staticmethod
+    def _repair(path):
+        # drops a record a crash left half written and brings the index up
+        # to date before appending. returns the offset of the last keyframe
+        entries = _read_index(path)
+        with open(path, 'r+b') as f:
+            _check_magic(f, path)
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                valid, end = _index_entries(data, len(data), entries)
+            f.truncate(end)
+        if valid != entries:
+            with open(path + INDEX_SUFFIX, 'wb') as f:
+                f.write(valid)
+        return _INDEX.unpack_from(valid, len(valid) - _INDEX.size)[2] if valid else 0
+
+    @staticmethod
+    def _pack_process(pid, row):
+        return _PROCESS.pack(pid, row.ppid, row.starttime, _percent(row.cpu), _percent(row.mem),
+                             row.rss, row.vsize, row.nice, row.priority) + \
+            _pack_string(row.name) + _pack_string(row.owner)
+
+    @staticmethod
+    def _pack_change(pid, old, new):
+        mask = 0
+        parts = []
+        for bit, (field, code) in enumerate(_FIELDS):
+            value = new[field]
+            if value == old[field]:
+                continue
+            if field in _PERCENT_FIELDS:
+                value = _percent(value)
+                if value == _percent(old[field]):
+                    continue
+            mask |= 1 << bit
+            parts.append(_pack_string(value) if code == 's' else _FIELD_STRUCTS[code].pack(value))
+        return _CHANGE.pack(pid, mask) + b''.join(parts) if mask else None
+
+    @timed('recorder.tick')
+    def record(self, timestamp, rows, gone=()):
+        # rows maps the pid of every process read this tick to its Row, the
+        # processes left out are taken to be unchanged. gone are the pids
+        # that exited
+        state = self.state
+        keyframe = self._ticks_since_keyframe is None or \
+            self._ticks_since_keyframe + 1 >= self.keyframe_interval
+
+        gone = set(gone)
+        removed = array('i', (pid for pid in gone if pid in state))
+        for pid in removed:
+            del state[pid]
+        added = []
+        changed = []
+        for pid, row in rows.items():
+            if pid in gone:
+                continue
+            old = state.get(pid)
+            if old is None or old.starttime != row.starttime:
+                # a recycled pid is removed and added back as a new process
+                if old is not None:
+                    removed.append(pid)
+                if not keyframe:
+                    added.append(self._pack_process(pid, row))
+            elif not keyframe and old != row:
+                change = self._pack_change(pid, old, row)
+                if change:
+                    changed.append(change)
+            state[pid] = row
+
+        offset = self._data.tell()
+        if keyframe:
+            body = _TICK.pack(timestamp, 0, len(state), 0) + \
+                b''.join(self._pack_process(pid, row) for pid, row in state.items())
+            self._keyframe = offset
+            self._ticks_since_keyframe = 0
+        else:
+            body = _TICK.pack(timestamp, len(removed), len(added), len(changed)) + \
+                removed.tobytes() + b''.join(added) + b''.join(changed)
+            self._ticks_since_keyframe += 1
+
+        # the record goes out before its index entry so the index never
+        # points past the end of the data
+        payload = zlib.compress(body, 1)
+        self._data.write(_RECORD.pack(KEYFRAME if keyframe else DELTA, len(payload)) + payload)
+        self._data.flush()
+        self._index.write(_INDEX.pack(timestamp, offset, self._keyframe))
+        self._index.flush()
+
+    def close(self):
+        self._data.close()
+        self._index.close()
+
+
+class SnapshotPlayer(object):
+    # reads a recording through mmap. state(tick) rebuilds the process
+    # table of any tick from its keyframe, stepping forward from the last
+    # tick asked for when that is closer
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        _check_magic(self._file, path)
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        # the files are only read, a recording still being written to can
+        # be replayed up to its last complete record
+        entries, _ = _index_entries(self._data, len(self._data), _read_index(path))
+        # timestamps, record offsets and keyframe offsets, one per tick.
+        # every _INDEX field is 8 bytes so the entries are split with slices
+        self.times = array('d', entries)[0::3]
+        offsets = array('Q', entries)
+        self._offsets = offsets[1::3]
+        self._keyframes = offsets[2::3]
+
+        self._tick = -1
+        self._state = {}
+
+    def __len__(self):
+        return len(self.times)
+
+    def timestamp(self, tick):
+        return self.times[tick]
+
+    def tick_at(self, timestamp):
+        # the last tick recorded at or before timestamp
+        low, high = 0, len(self.times)
+        while low < high:
+            middle = (low + high) // 2
+            if self.times[middle] <= timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return max(0, low - 1)
+
+    @timed('player.state')
+    def state(self, tick):
+        # returns pid -> Row for tick. the dict is reused, copy it to keep it
+        keyframe = self._keyframes[tick]
+        if not (self._tick <= tick and self._tick >= 0 and
+                self._offsets[self._tick] >= keyframe):
+            # start over from the keyframe
+            self._tick = tick - 1
+            while self._tick >= 0 and self._offsets[self._tick] >= keyframe:
+                self._tick -= 1
+            self._state = {}
+        for step in range(self._tick + 1, tick + 1):
+            _decode(self._data, self._offsets[step], self._state)
+        self._tick = tick
+        return self._state
+
+    def close(self):
+        self._data.close()
+        self._file.close()
+
+
+class RecordedProcess(object):
+    # stands in for a procutil.Process while a recording is replayed, or
+    # for one on the host of an agent.SnapshotAgent. only the recorded
+    # columns exist, there are no handles to show
+    def __init__(self, pid, row):
+        self._pid = pid
+        self.row = row
+
+    def pid(self):
+        return self._pid
+
+    def name(self):
+        return self.row.name
+
+    def cmdline(self):
+        # not part of a recording
+        return []
+
+    def descriptors(self):
+        return []
+
+    def libraries(self):
+        return []
@@ -0,0 +1,70 @@
+import time
+
+
+class RefreshScheduler(object):
+    # decides when the next refresh tick should run. the interval starts at
+    # base_interval and is stretched while the explorer's own cpu use (all
+    # of its threads, GUI included, and its helper processes) is above
+    # budget, then shrinks back once it is comfortably below it. the
+    # explorer should not become one of the top processes on the loaded
+    # machine it is being used to look at
+    BACKOFF_FACTOR = 1.5
+
+    def __init__(self, base_interval, budget=0.05, max_interval=None, helper_cpu_time=None):
+        # intervals are in milliseconds, budget is a fraction of one cpu.
+        # helper_cpu_time returns the cpu seconds spent so far by processes
+        # working for the explorer, e.g. the collector's parser processes
+        self.helper_cpu_time = helper_cpu_time
+        self.base_interval = base_interval
+        self.interval = base_interval
+        self.budget = budget
+        self.max_interval = max_interval or base_interval * 16
+
+        # ticks that would have run at base_interval but did not, because
+        # the interval was stretched or a tick took longer than the interval
+        self.skipped = 0
+
+        self.last_tick_cost = 0
+        self.cpu_share = 0
+        self._last_start = None
+        self._tick_start = 0
+        self._last_wall = time.monotonic()
+        self._last_cpu = self._cpu_time()
+
+    def _cpu_time(self):
+        cpu = time.process_time()
+        if self.helper_cpu_time is not None:
+            cpu += self.helper_cpu_time()
+        return cpu
+
+    def set_base_interval(self, interval):
+        self.base_interval = interval
+        self.interval = max(interval, min(self.interval, self.max_interval))
+
+    def tick_started(self):
+        now = time.monotonic()
+        if self._last_start is not None:
+            missed = int((now - self._last_start) * 1000 / self.base_interval) - 1
+            self.skipped += max(0, missed)
+        self._last_start = now
+        self._tick_start = now
+
+    def tick_finished(self):
+        # returns the delay in milliseconds until the next tick should start
+        now = time.monotonic()
+        cpu = self._cpu_time()
+        self.last_tick_cost = now - self._tick_start
+        wall = now - self._last_wall
+        if wall > 0:
+            self.cpu_share = (cpu - self._last_cpu) / wall
+        self._last_wall = now
+        self._last_cpu = cpu
+
+        if self.cpu_share > self.budget:
+            self.interval = min(self.max_interval, int(self.interval * self.BACKOFF_FACTOR))
+        elif self.cpu_share < self.budget / 2:
+            self.interval = max(self.base_interval, int(self.interval / self.BACKOFF_FACTOR))
+
+        # the interval is measured from the start of a tick so a slow tick
+        # does not push the following ones back by its own length
+        return max(0, self.interval - int(self.last_tick_cost * 1000))
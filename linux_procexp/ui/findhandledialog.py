@@ -1,8 +1,40 @@
 from PyQt4.QtGui import QDialog, QHBoxLayout, QVBoxLayout, QLabel, QLineEdit, QPushButton, \
-     QTableWidget, QTableWidgetItem
-from PyQt4.QtCore import Qt, pyqtSlot
+     QTableWidget, QTableWidgetItem, QProgressBar
+from PyQt4.QtCore import Qt, QObject, QThread, pyqtSignal, pyqtSlot
+
+class FindHandleWorker(QObject):
+    # every signal carries the generation of the search it belongs to so
+    # results of a cancelled search still in the event queue can be dropped
+    resultsFound = pyqtSignal(int, list)
+    progress = pyqtSignal(int, int, int)
+    searchFinished = pyqtSignal(int)
+
+    def __init__(self, model, parent=None):
+        super().__init__(parent)
+        self.model = model
+        # bumped from the GUI thread to cancel the running search. the
+        # search loop runs in the worker thread and checks it between
+        # batches, so this cannot go through a queued slot
+        self.generation = 0
+
+    def cancel(self):
+        self.generation += 1
+        return self.generation
+
+    @pyqtSlot(str, int)
+    def search(self, substr, generation):
+        for batch, scanned, total in self.model.iterHandlesBySubstr(substr):
+            if generation != self.generation:
+                return
+            if batch:
+                self.resultsFound.emit(generation, batch)
+            self.progress.emit(generation, scanned, total)
+        self.searchFinished.emit(generation)
+
 
 class FindHandleDialog(QDialog):
+    startSearch = pyqtSignal(str, int)
+
     def __init__(self, model, parent):
         super().__init__(parent)
         self.model = model
@@ -20,6 +52,9 @@ class FindHandleDialog(QDialog):
         btnSearch = QPushButton('&Search')
         btnSearch.clicked.connect(self.onBtnSearchClicked)
         btnCancel = QPushButton('&Cancel')
+        btnCancel.clicked.connect(self.cancelSearch)
+        # a search for a query that is no longer in the box is not useful
+        self.txtSearch.textChanged.connect(self.cancelSearch)
         searchLayout = QHBoxLayout()
         searchLayout.addWidget(lblSearch)
         searchLayout.addWidget(self.txtSearch)
@@ -32,22 +67,71 @@ class FindHandleDialog(QDialog):
         self.tblResults.setShowGrid(False)
         self.tblResults.setSelectionBehavior(QTableWidget.SelectRows)
         self.tblResults.verticalHeader().setDefaultSectionSize(24)
+        self.progressBar = QProgressBar()
+        self.progressBar.setFormat('%v of %m processes scanned')
+        self.progressBar.setVisible(False)
         mainLayout = QVBoxLayout()
         mainLayout.addLayout(searchLayout)
         mainLayout.addWidget(self.tblResults)
+        mainLayout.addWidget(self.progressBar)
         self.setLayout(mainLayout)
 
+        # searches run in their own thread and stream their results back
+        # so the GUI stays responsive while processes are scanned
+        self.searchGeneration = 0
+        self.searchThread = QThread(self)
+        self.searchWorker = FindHandleWorker(self.model)
+        self.searchWorker.moveToThread(self.searchThread)
+        self.startSearch.connect(self.searchWorker.search)
+        self.searchWorker.resultsFound.connect(self.addResults)
+        self.searchWorker.progress.connect(self.showProgress)
+        self.searchWorker.searchFinished.connect(self.onSearchFinished)
+        self.finished.connect(self.stopSearchThread)
+        self.searchThread.start()
+
     @pyqtSlot(bool)
     def onBtnSearchClicked(self, checked=False):
         handleSubstr = self.txtSearch.text()
         if handleSubstr:
-            results = self.model.findHandlesBySubstr(handleSubstr)
-            self.tblResults.setRowCount(len(results))
-            for row, res in enumerate(results):
-                for col, prop in enumerate(res):
-                    item = QTableWidgetItem(str(prop))
-                    item.setFlags(Qt.ItemIsSelectable | Qt.ItemIsEnabled)
-                    self.tblResults.setItem(row, col, item)
+            self.searchGeneration = self.searchWorker.cancel()
+            self.tblResults.setRowCount(0)
+            self.progressBar.setValue(0)
+            self.progressBar.setVisible(True)
+            self.startSearch.emit(handleSubstr, self.searchGeneration)
+
+    @pyqtSlot()
+    def cancelSearch(self):
+        self.searchWorker.cancel()
+        self.progressBar.setVisible(False)
+
+    @pyqtSlot(int, list)
+    def addResults(self, generation, results):
+        if generation != self.searchWorker.generation:
+            return
+        firstRow = self.tblResults.rowCount()
+        self.tblResults.setRowCount(firstRow + len(results))
+        for row, res in enumerate(results, start=firstRow):
+            for col, prop in enumerate(res):
+                item = QTableWidgetItem(str(prop))
+                item.setFlags(Qt.ItemIsSelectable | Qt.ItemIsEnabled)
+                self.tblResults.setItem(row, col, item)
+
+    @pyqtSlot(int, int, int)
+    def showProgress(self, generation, scanned, total):
+        if generation == self.searchWorker.generation:
+            self.progressBar.setMaximum(total)
+            self.progressBar.setValue(scanned)
+
+    @pyqtSlot(int)
+    def onSearchFinished(self, generation):
+        if generation == self.searchWorker.generation:
+            self.progressBar.setVisible(False)
+
+    @pyqtSlot(int)
+    def stopSearchThread(self):
+        self.searchWorker.cancel()
+        self.searchThread.quit()
+        self.searchThread.wait()
 
     def keyPressEvent(self, event):
         if event.key() == Qt.Key_Enter and self.txtSearch.hasFocus():
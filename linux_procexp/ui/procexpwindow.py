@@ -1,11 +1,23 @@
-from PyQt4.QtGui import QAction, QMainWindow, QSplitter, QTableWidget, QTableWidgetItem, QColor, QApplication
-from PyQt4.QtCore import Qt, pyqtSlot, QModelIndex, QEvent
+import time
+from PyQt4.QtGui import QAction, QMainWindow, QSplitter, QTableWidget, QTableWidgetItem, QColor, \
+     QApplication, QLabel, QFileDialog, QMessageBox, QSlider, QLineEdit, QDateTimeEdit
+from PyQt4.QtCore import Qt, pyqtSignal, pyqtSlot, QModelIndex, QEvent, QTimer, QDateTime
 from .proctablewidget import ProcTableWidget
 from ..proctablemodel import ProcTableModel
+from ..recording import SnapshotRecorder, SnapshotPlayer
+from ..procfilter import ProcFilter, FilterSyntaxError
 from .findhandledialog import FindHandleDialog
 
 class ProcExpWindow(QMainWindow):
-    def __init__(self, parent=None):
+    # the process whose threads are shown, sent to the refresher's thread.
+    # a qint64 as it is the model's key, see ProcTableModelAggregator
+    threadPidChanged = pyqtSignal('qint64')
+
+    # a tick of the recording being replayed to show
+    seekRequested = pyqtSignal(int)
+
+    def __init__(self, parent=None, workers=1, parseProcesses=0, cpuBudget=0.05, pidEvents=True,
+                 recordPath=None, replayPath=None, agents=None):
         super().__init__(parent)
         # setup menu bar
         exitItem = QAction('Exit', self)
@@ -14,11 +26,25 @@ class ProcExpWindow(QMainWindow):
         exitItem.triggered.connect(self.close)
         menuBar = self.menuBar()
         fileMenu = menuBar.addMenu('&File')
+        exportHistoryItem = QAction('Export History...', self)
+        exportHistoryItem.setStatusTip('Save the recent cpu and memory use of the selected process')
+        exportHistoryItem.triggered.connect(self.exportHistory)
+        fileMenu.addAction(exportHistoryItem)
         fileMenu.addAction(exitItem)
 
-        # setup widgets
-        self.model = ProcTableModel(self)
-        self.procTable = ProcTableWidget(self.model)
+        # setup widgets. only the refresher reading /proc writes to a recorder
+        if recordPath and (replayPath or agents):
+            raise ValueError('only the local processes can be recorded')
+        self.player = SnapshotPlayer(replayPath) if replayPath else None
+        self.model = ProcTableModel(self, live=self.player is None and not agents)
+        self.procTable = ProcTableWidget(self.model, workers=workers,
+                                         parseProcesses=parseProcesses, cpuBudget=cpuBudget,
+                                         pidEvents=pidEvents, player=self.player, agents=agents)
+        if recordPath:
+            self.procTable.modelRefresher.recorder = SnapshotRecorder(recordPath)
+        self.setupFilterBar()
+        if self.player is not None:
+            self.setupReplayBar()
         self.procTable.clicked.connect(self.showDescriptors)
         self.handlesTable = QTableWidget()
         self.handlesTable.setColumnCount(2)
@@ -31,11 +57,52 @@ class ProcExpWindow(QMainWindow):
         # TODO: find a way to get the row height from the QTreeView
         self.handlesTable.verticalHeader().setDefaultSectionSize(24)
 
+        # threads of the selected process, re-read by the refresher on
+        # every tick. the busiest threads are listed first
+        self.threadsTable = QTableWidget()
+        self.threadsTable.setColumnCount(len(self.threadHeaders))
+        self.threadsTable.setHorizontalHeaderLabels(self.threadHeaders)
+        self.threadsTable.verticalHeader().setVisible(False)
+        self.threadsTable.setShowGrid(False)
+        self.threadsTable.setSelectionBehavior(QTableWidget.SelectRows)
+        self.threadsTable.horizontalHeader().setStretchLastSection(True)
+        self.threadsTable.verticalHeader().setDefaultSectionSize(24)
+        # the selected process and the one the refresher reads the threads
+        # of, which is 0 while the threads table cannot be seen
+        self.threadPid = 0
+        self.sampledThreadPid = 0
+        self.threadPidChanged.connect(self.procTable.modelRefresher.setThreadPid)
+        self.procTable.modelRefresher.threadsRefreshed.connect(self.showThreads)
+
+        detailsSplitter = QSplitter(Qt.Horizontal)
+        detailsSplitter.addWidget(self.handlesTable)
+        detailsSplitter.addWidget(self.threadsTable)
+        detailsSplitter.splitterMoved.connect(self.updateThreadPid)
+
         mainSplitter = QSplitter(Qt.Vertical)
         mainSplitter.addWidget(self.procTable)
-        mainSplitter.addWidget(self.handlesTable)
+        mainSplitter.addWidget(detailsSplitter)
+        mainSplitter.splitterMoved.connect(self.updateThreadPid)
         self.setCentralWidget(mainSplitter)
 
+        # shows how long the last refresh tick took so the number of
+        # collector workers can be tuned
+        self.lblTickTime = QLabel()
+        self.statusBar().addPermanentWidget(self.lblTickTime)
+        self.procTable.modelRefresher.tickFinished.connect(self.showTickTime)
+
+        # the refresh interval stretches while the explorer itself uses
+        # too much cpu, show by how much and how many ticks it skipped
+        self.lblSchedule = QLabel()
+        self.statusBar().addPermanentWidget(self.lblSchedule)
+        self.procTable.modelRefresher.scheduleChanged.connect(self.showSchedule)
+
+        # with the kernel's process events, how many processes exited
+        # before a tick could show them and how often events were lost
+        self.lblPidEvents = QLabel()
+        self.statusBar().addPermanentWidget(self.lblPidEvents)
+        self.procTable.modelRefresher.pidEventsChanged.connect(self.showPidEvents)
+
         desktopGeometry = QApplication.desktop().screenGeometry()
         self.setGeometry(0, 0, 1280, 700)
         self.move((desktopGeometry.width() - self.width()) / 2,
@@ -45,10 +112,116 @@ class ProcExpWindow(QMainWindow):
         # find handle dialog
         self.findDialog = None
 
+    threadHeaders = ('TID', 'Name', 'State', 'CPU %', 'Priority', 'Nice')
+
+    def setupFilterBar(self):
+        self.filterEdit = QLineEdit()
+        self.filterEdit.setPlaceholderText('Filter, e.g. user:postgres name:java* rss>1G')
+        filterBar = self.addToolBar('Filter')
+        filterBar.addWidget(self.filterEdit)
+
+        # the query is applied once typing pauses rather than on every key
+        self.filterTimer = QTimer(self)
+        self.filterTimer.setSingleShot(True)
+        self.filterTimer.setInterval(200)
+        self.filterTimer.timeout.connect(self.applyFilter)
+        self.filterEdit.textChanged.connect(lambda text: self.filterTimer.start())
+
+    @pyqtSlot()
+    def applyFilter(self):
+        # a query that does not parse leaves the previous one in place
+        try:
+            procFilter = ProcFilter(self.filterEdit.text())
+        except FilterSyntaxError as e:
+            self.filterEdit.setStyleSheet('color: red')
+            self.filterEdit.setToolTip(str(e))
+            return
+        self.filterEdit.setStyleSheet('')
+        self.filterEdit.setToolTip('')
+        self.procTable.setFilter(procFilter)
+
+    def setupReplayBar(self):
+        # play/pause and a slider to scrub through the recording's ticks
+        replayBar = self.addToolBar('Replay')
+        playItem = QAction('Play', self)
+        playItem.setCheckable(True)
+        playItem.toggled.connect(self.procTable.modelRefresher.setPlaying)
+        replayBar.addAction(playItem)
+
+        self.replaySlider = QSlider(Qt.Horizontal)
+        self.replaySlider.setRange(0, max(0, len(self.player) - 1))
+        self.replaySlider.valueChanged.connect(self.seekRequested)
+        self.seekRequested.connect(self.procTable.modelRefresher.seek)
+        replayBar.addWidget(self.replaySlider)
+
+        self.lblReplayTime = QLabel()
+        replayBar.addWidget(self.lblReplayTime)
+        self.procTable.modelRefresher.tickChanged.connect(self.showReplayTick)
+
+        # jumps to the last tick recorded at or before the time entered
+        self.replayTimeEdit = QDateTimeEdit()
+        self.replayTimeEdit.setDisplayFormat('yyyy-MM-dd HH:mm:ss')
+        if len(self.player):
+            self.replayTimeEdit.setDateTimeRange(
+                QDateTime.fromTime_t(int(self.player.timestamp(0))),
+                QDateTime.fromTime_t(int(self.player.timestamp(len(self.player) - 1)) + 1))
+        self.replayTimeEdit.editingFinished.connect(self.seekToTime)
+        replayBar.addWidget(self.replayTimeEdit)
+
+    @pyqtSlot()
+    def seekToTime(self):
+        if len(self.player):
+            self.seekRequested.emit(
+                self.player.tick_at(self.replayTimeEdit.dateTime().toTime_t()))
+
+    @pyqtSlot(int, float)
+    def showReplayTick(self, tick, timestamp):
+        # moving the slider while playing would seek to the same tick again
+        self.replaySlider.blockSignals(True)
+        self.replaySlider.setValue(tick)
+        self.replaySlider.blockSignals(False)
+        self.lblReplayTime.setText('{}  ({}/{})'.format(
+            time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp)),
+            tick + 1, len(self.player)))
+
+    @pyqtSlot(float)
+    def showTickTime(self, seconds):
+        self.lblTickTime.setText('Refresh: {:.0f} ms'.format(seconds * 1000))
+
+    @pyqtSlot(int, int)
+    def showSchedule(self, interval, skipped):
+        self.lblSchedule.setText('Interval: {} ms  Skipped: {}'.format(interval, skipped))
+
+    @pyqtSlot(str, int, int)
+    def showPidEvents(self, source, shortLived, overflows):
+        if source == 'poll':
+            self.lblPidEvents.setText('Pids: poll')
+        else:
+            self.lblPidEvents.setText('Pids: {}  Short-lived: {}  Overflows: {}'.format(
+                source, shortLived, overflows))
+
+    @pyqtSlot()
+    def exportHistory(self):
+        current = self.procTable.currentIndex()
+        if not current.isValid():
+            QMessageBox.information(self, 'Export History', 'Select a process first.')
+            return
+        node = self.model.nodeFromIndex(current)
+        fileName = QFileDialog.getSaveFileName(
+            self, 'Export History', '{}-{}.csv'.format(node.fields(0), node.pid),
+            'CSV files (*.csv)')
+        if fileName:
+            with open(fileName, 'w', newline='') as f:
+                self.model.history.export(node.pid, f)
+
     @pyqtSlot(int)
     def removeFindDialog(self):
         self.findDialog = None
 
+    def closeEvent(self, event):
+        self.procTable.stopRefreshThread()
+        super().closeEvent(event)
+
     def keyPressEvent(self, event):
         modifiers = event.modifiers()
         if event.key() == Qt.Key_F and modifiers & Qt.ControlModifier:
@@ -61,8 +234,50 @@ class ProcExpWindow(QMainWindow):
         else:
             super().keyPressEvent(event)
 
+    @pyqtSlot()
+    def updateThreadPid(self):
+        # threads are only read while their table is on screen, i.e. not
+        # collapsed by a splitter nor in a minimized window
+        pid = self.threadPid
+        if self.isMinimized() or self.threadsTable.visibleRegion().isEmpty():
+            pid = 0
+        if pid != self.sampledThreadPid:
+            self.sampledThreadPid = pid
+            self.threadPidChanged.emit(pid)
+
+    def changeEvent(self, event):
+        if event.type() == QEvent.WindowStateChange:
+            self.updateThreadPid()
+        super().changeEvent(event)
+
+    @pyqtSlot('qint64', list)
+    def showThreads(self, pid, threads):
+        # a late tick for the previously selected process is dropped
+        if pid != self.threadPid:
+            return
+        threads.sort(key=lambda thread: thread.cpu, reverse=True)
+        self.threadsTable.setRowCount(len(threads))
+
+        # the items are kept from tick to tick and only their text changes
+        for row, thread in enumerate(threads):
+            values = (thread.tid, thread.name, thread.state, thread.cpu,
+                      thread.priority, thread.nice)
+            for col, value in enumerate(values):
+                item = self.threadsTable.item(row, col)
+                if item is None:
+                    item = QTableWidgetItem()
+                    item.setFlags(Qt.ItemIsSelectable | Qt.ItemIsEnabled)
+                    self.threadsTable.setItem(row, col, item)
+                item.setText(str(value))
+
     @pyqtSlot(QModelIndex)
     def showDescriptors(self, processMIdx):
+        pid = processMIdx.internalPointer().pid
+        if pid != self.threadPid:
+            self.threadPid = pid
+            self.threadsTable.setRowCount(0)
+            self.updateThreadPid()
+
         try:
             self.handlesTable.setRowCount(0)
             self.handlesTable.clearContents()
@@ -1,9 +1,13 @@
-from PyQt4.QtGui import QTreeView
-from PyQt4.QtCore import QThread, pyqtSlot, Qt
-from ..proctablemodel import ProcTableModelRefresher
+import itertools
+from PyQt4.QtGui import QTreeView, QMenu
+from PyQt4.QtCore import QThread, QPoint, QModelIndex, pyqtSlot, Qt
+from ..proctablemodel import ProcTableModelRefresher, ProcTableModelReplayer, \
+     ProcTableModelAggregator, ProcessNode
+from .sparklinedelegate import SparklineDelegate
 
 class ProcTableWidget(QTreeView):
-    def __init__(self, model, parent=None):
+    def __init__(self, model, parent=None, workers=1, parseProcesses=0, cpuBudget=0.05,
+                 pidEvents=True, player=None, agents=None):
         super().__init__(parent)
         self.setSelectionBehavior(QTreeView.SelectRows)
 
@@ -23,14 +27,178 @@ class ProcTableWidget(QTreeView):
         self.header().sectionClicked.connect(self.setSortIndicator)
 
         # this worker thread grabs the latest process properties
-        # so the GUI doesn't lag when it needs to update process data
+        # so the GUI doesn't lag when it needs to update process data.
+        # with a recording.SnapshotPlayer the data comes from a recording
+        # and with the addresses of agents from agent.SnapshotAgents
         self.refreshThread = QThread(self)
-        self.modelRefresher = ProcTableModelRefresher(self.model)
+        if agents:
+            self.modelRefresher = ProcTableModelAggregator(self.model, agents)
+        elif player is None:
+            self.modelRefresher = ProcTableModelRefresher(self.model, workers=workers,
+                                                          parseProcesses=parseProcesses,
+                                                          cpuBudget=cpuBudget,
+                                                          pidEvents=pidEvents)
+        else:
+            self.modelRefresher = ProcTableModelReplayer(self.model, player)
         self.modelRefresher.moveToThread(self.refreshThread)
         self.modelRefresher.modelRefresh.connect(self.model.update)
+        self.modelRefresher.modelRefresh.connect(self.refilter)
+        self.model.fullRefreshRequested.connect(self.modelRefresher.requestFullRefresh)
         self.refreshThread.started.connect(self.modelRefresher.startRefreshTimer)
         self.refreshThread.start()
 
+        # the optional columns are hidden until picked from the
+        # header's context menu
+        for colIdx in self.model.optionalColumns:
+            self.setColumnHidden(colIdx, True)
+        self.updateVisibleColumns()
+        self.header().setContextMenuPolicy(Qt.CustomContextMenu)
+        self.header().customContextMenuRequested.connect(self.showColumnsMenu)
+
+        # the history columns are drawn from the model's history, which
+        # changes for every process on every tick. rather than a dataChanged
+        # per row only what is on screen is repainted
+        for colIdx in self.model.historyColumns:
+            self.setItemDelegateForColumn(colIdx, SparklineDelegate(
+                self.model.history, ProcessNode.HISTORY_COLUMNS[colIdx], self))
+        self.modelRefresher.modelRefresh.connect(self.repaintHistory)
+
+        # the refresher reads the processes on screen every tick and the
+        # rest less often, so tell it what is on screen whenever that changes
+        self.verticalScrollBar().valueChanged.connect(self.updateVisiblePids)
+        self.expanded.connect(self.updateVisiblePids)
+        self.collapsed.connect(self.updateVisiblePids)
+        self.modelRefresher.modelRefresh.connect(self.updateVisiblePids)
+
+        # the procfilter.ProcFilter rows are shown by, or None, the
+        # processes matching it and the rows hidden for it (see
+        # updateHiddenRows). a row removed and inserted again by the model
+        # comes back shown, those are kept to be hidden again
+        self.procFilter = None
+        self.filterMatches = set()
+        self.hiddenNodes = set()
+        self.insertedNodes = set()
+        self.model.rowsInserted.connect(self.rememberInsertedRows)
+
+    def stopRefreshThread(self):
+        # the refresher's pid source and worker pools are only let go once
+        # its thread is done with them
+        self.refreshThread.quit()
+        self.refreshThread.wait()
+        self.modelRefresher.shutdown()
+
+    @pyqtSlot()
+    def updateVisiblePids(self):
+        pids = set()
+        viewportHeight = self.viewport().height()
+        mIdx = self.indexAt(QPoint(0, 0))
+        while mIdx.isValid() and self.visualRect(mIdx).top() < viewportHeight:
+            # ancestors stay in the set so the rows leading to the visible
+            # ones (and their expand state) are current as well
+            node = self.model.nodeFromIndex(mIdx)
+            while node is not None and node.pid not in pids and node.pid != 0:
+                pids.add(node.pid)
+                node = node.parent
+            mIdx = self.indexBelow(mIdx)
+        current = self.currentIndex()
+        if current.isValid():
+            pids.add(self.model.nodeFromIndex(current).pid)
+        self.modelRefresher.setVisiblePids(pids)
+
+    def setFilter(self, procFilter):
+        # every process is checked against a new filter, after that only
+        # those the refresher reports as added or changed
+        self.procFilter = procFilter or None
+        self.filterMatches = set()
+        self.modelRefresher.readCmdline = self.procFilter is not None and \
+            'cmdline' in self.procFilter.fields
+        if self.procFilter is not None:
+            # the refresher adds and removes processes while this runs
+            matches = self.procFilter.matches
+            self.filterMatches = {node for node in list(self.model.procTable.values())
+                                  if matches(node.filterValue)}
+        self.updateHiddenRows()
+        self.updateVisiblePids()
+
+    @pyqtSlot(object)
+    def refilter(self, delta):
+        if self.procFilter is None:
+            self.insertedNodes.clear()
+            return
+        matches = self.procFilter.matches
+        for node in delta.removed:
+            self.filterMatches.discard(node)
+        for node in itertools.chain(delta.added, (node for node, firstCol, lastCol in delta.changed)):
+            if matches(node.filterValue):
+                self.filterMatches.add(node)
+            else:
+                self.filterMatches.discard(node)
+        self.updateHiddenRows()
+
+    @pyqtSlot(QModelIndex, int, int)
+    def rememberInsertedRows(self, parentMIdx, first, last):
+        if self.procFilter is not None:
+            children = self.model.nodeFromIndex(parentMIdx).children
+            self.insertedNodes.update(children[first:last + 1])
+
+    def updateHiddenRows(self):
+        # a row is shown when its process or one below it matches. only
+        # the rows to hide whose parent is shown are set hidden, the rest
+        # go out of sight with them, which keeps the view's set of hidden
+        # rows (and so the persistent indexes the model keeps) small
+        visible = {self.model.root}
+        for node in self.filterMatches:
+            while node is not None and node not in visible:
+                visible.add(node)
+                node = node.parent
+        hidden = set()
+        if self.procFilter is not None:
+            for parentNode in visible:
+                hidden.update(child for child in parentNode.children if child not in visible)
+
+        for node in self.hiddenNodes - hidden:
+            if node.parent is not None:
+                self.setRowHidden(node.row, self.model.modelIndex(node.parent), False)
+        for node in (hidden - self.hiddenNodes) | (hidden & self.insertedNodes):
+            self.setRowHidden(node.row, self.model.modelIndex(node.parent), True)
+        self.hiddenNodes = hidden
+        self.insertedNodes.clear()
+
+    @pyqtSlot()
+    def repaintHistory(self):
+        if any(not self.isColumnHidden(colIdx) for colIdx in self.model.historyColumns):
+            self.viewport().update()
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.updateVisiblePids()
+
+    @pyqtSlot(QPoint)
+    def showColumnsMenu(self, pos):
+        menu = QMenu(self)
+        for colIdx in self.model.optionalColumns:
+            action = menu.addAction(self.model.headers[colIdx])
+            action.setCheckable(True)
+            action.setChecked(not self.isColumnHidden(colIdx))
+            action.setData(colIdx)
+        menu.addSeparator()
+        treeAction = menu.addAction('Sort Within Tree')
+        treeAction.setCheckable(True)
+        treeAction.setChecked(self.model.sortWithinTree)
+        chosen = menu.exec_(self.header().mapToGlobal(pos))
+        if chosen is treeAction:
+            self.model.setSortWithinTree(chosen.isChecked())
+        elif chosen is not None:
+            self.setColumnHidden(chosen.data(), not chosen.isChecked())
+            self.updateVisibleColumns()
+
+    def updateVisibleColumns(self):
+        self.modelRefresher.readFootprint = any(
+            not self.isColumnHidden(colIdx) for colIdx in self.model.footprintColumns)
+        # only used by ProcTableModelAggregator, to subscribe to these
+        self.modelRefresher.visibleColumns = [
+            colIdx for colIdx in range(len(self.model.headers)) if not self.isColumnHidden(colIdx)]
+
     @pyqtSlot(int)
     def setSortIndicator(self, columnIdx):
         if self.isSortingEnabled():
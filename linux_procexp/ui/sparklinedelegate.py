@@ -0,0 +1,34 @@
+from PyQt4.QtGui import QStyledItemDelegate, QPolygonF, QPen, QColor, QPainter
+from PyQt4.QtCore import QPointF
+
+class SparklineDelegate(QStyledItemDelegate):
+    # draws a process' recent values of one metric from the model's
+    # ProcHistory instead of the cell's text
+    def __init__(self, history, metric, parent=None, color=QColor(0, 120, 215)):
+        super().__init__(parent)
+        self.history = history
+        self.metric = metric
+        self.pen = QPen(color)
+
+    def paint(self, painter, option, index):
+        # the background and selection come from the style as usual
+        super().paint(painter, option, index)
+        node = index.internalPointer()
+        values = self.history.series(self.metric, node.pid)
+        if len(values) < 2:
+            return
+
+        rect = option.rect.adjusted(2, 2, -2, -2)
+        highest = max(values) or 1
+        step = rect.width() / (self.history.depth - 1)
+        # the newest value is at the right edge
+        left = rect.right() - step * (len(values) - 1)
+        points = QPolygonF([QPointF(left + step * i,
+                                    rect.bottom() - value / highest * rect.height())
+                            for i, value in enumerate(values)])
+
+        painter.save()
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.setPen(self.pen)
+        painter.drawPolyline(points)
+        painter.restore()
@@ -1,10 +1,42 @@
+import argparse
 import sys
 from PyQt4.QtGui import QApplication
 from linux_procexp.ui.procexpwindow import ProcExpWindow
+from linux_procexp.procutil import ProcUtil
+
+def parseArgs():
+    parser = argparse.ArgumentParser(description='Linux Process Explorer')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='threads reading /proc on every refresh')
+    parser.add_argument('--parse-processes', type=int, default=0,
+                        help='processes parsing what the workers read (0 parses in the workers)')
+    parser.add_argument('--cpu-budget', type=float, default=5,
+                        help='percent of a cpu the explorer may use before it refreshes less often')
+    parser.add_argument('--no-pid-events', dest='pid_events', action='store_false',
+                        help='list /proc every refresh instead of following fork/exit events')
+    # only the local processes can be recorded
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--record', metavar='FILE',
+                        help='append every refresh to this recording')
+    source.add_argument('--replay', metavar='FILE',
+                        help='show a recording instead of the running processes')
+    source.add_argument('--connect', metavar='ADDRESS', action='append',
+                        help='show the processes served by the agent at this socket path or '
+                             'host:port instead of the local ones, can be given more than once')
+    parser.add_argument('--proc-root', default='/proc',
+                        help='read processes from this directory instead of /proc')
+    parser.add_argument('--stats', action='store_true',
+                        help='print call counts and timings on exit')
+    # the remaining arguments are left for Qt
+    return parser.parse_known_args()
 
 def main():
-    app = QApplication(sys.argv)
-    mw = ProcExpWindow()
+    args, qtArgs = parseArgs()
+    ProcUtil.set_proc_path(args.proc_root)
+    app = QApplication(sys.argv[:1] + qtArgs)
+    mw = ProcExpWindow(workers=args.workers, parseProcesses=args.parse_processes,
+                       cpuBudget=args.cpu_budget / 100, pidEvents=args.pid_events,
+                       recordPath=args.record, replayPath=args.replay, agents=args.connect)
     mw.show()
     sys.exit(app.exec_())
 